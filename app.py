@@ -2,9 +2,10 @@ import tkinter as tk
 from tkinter import Scale, HORIZONTAL
 import sys
 import logging
-from matplotlib import pyplot as plt
+import circle
 import image
 import thread_calculator
+import result_cache
 
 # Get a logger for this module
 logger = logging.getLogger(__name__)
@@ -20,6 +21,9 @@ class CircleThreadArtApp:
         
         # Initialize instance variables
         self.num_pins = 150 # Default value for the number of pins
+        self.result_cache = result_cache.ResultCache()
+        # pins, layout and image path of the last calculation, used for warm start
+        self._last_solution = None
 
         # Main frame to hold controls, canvas, and console panel
         self.main_frame = tk.Frame(self.root)
@@ -67,6 +71,21 @@ class CircleThreadArtApp:
         self.pins_slider.set(self.num_pins) # Set initial value
         self.pins_slider.pack(side=tk.LEFT, padx=5, pady=5)
 
+        # Shape of the frame
+        self.shape_var = tk.StringVar(value=circle.FRAME_SHAPES[0])
+        self.shape_menu = tk.OptionMenu(self.control_frame, self.shape_var, *circle.FRAME_SHAPES, command=self.update_shape)
+        self.shape_menu.pack(side=tk.LEFT, padx=5, pady=5)
+
+        # Checkbox for continuing from the previous result
+        self.warm_start_var = tk.BooleanVar(value=True)
+        self.warm_start_check = tk.Checkbutton(self.control_frame, text="Warm start", variable=self.warm_start_var)
+        self.warm_start_check.pack(side=tk.LEFT, padx=5, pady=5)
+
+        # Checkbox for scoring lines on blurred image
+        self.perceptual_var = tk.BooleanVar(value=False)
+        self.perceptual_check = tk.Checkbutton(self.control_frame, text="Perceptual", variable=self.perceptual_var)
+        self.perceptual_check.pack(side=tk.LEFT, padx=5, pady=5)
+
         # Button for calculating thread art
         self.calculate_thread_art_button = tk.Button(self.control_frame, text="Calculate Thread Art", command=self.calculate_thread_art)
         self.calculate_thread_art_button.pack(side=tk.RIGHT, padx=5, pady=5)
@@ -86,6 +105,14 @@ class CircleThreadArtApp:
         self.image_app.set_circle_num_pins(self.num_pins)
         logger.debug(f"Number of Pins updated to: {self.num_pins}")
 
+    def update_shape(self, value):
+        """
+        Callback function for the frame shape menu.
+        """
+        self.image_app.circle.set_shape(value)
+        self.image_app.circle.draw_circle()
+        logger.debug(f"Frame shape updated to: {value}")
+
 
     def calculate_thread_art(self):
         """calculating thread art"""
@@ -101,8 +128,33 @@ class CircleThreadArtApp:
         default_sqaure_size=1000
         prepared_image = prepared_image.resize((default_sqaure_size,default_sqaure_size))
         prepared_image.save("calculating.png")
-        tc=thread_calculator.thread_calculator(prepared_image,self.image_app.circle.start_angle,self.num_pins)
-        calculated_image=tc.calculate_thread(limit=2000)
+        # fixed seed keeps pin layout the same so repeated calculations hit the cache
+        layout = self.image_app.circle.pin_layout(default_sqaure_size)
+        tc=thread_calculator.thread_calculator(prepared_image,self.image_app.circle.start_angle,self.num_pins,seed=0,layout=layout)
+        if self.perceptual_var.get():
+            tc.set_perceptual_scoring()
+        last = self._last_solution
+        on_miss = None
+        if self.warm_start_var.get() and last and last["path"] == self.image_app._path:
+            def warm_start():
+                # cached result of the same settings is used first, warm start only on cache miss
+                self.console_text.write("warm start from previous result...\n")
+                # circles are matched by angle, other frames by the nearest pin
+                same_circle = layout is None and last["shape"] == "circle"
+                return tc.warm_start(last["pins"],last["num_pins"],last["start_angle"],repair_lines=200,limit=2000,
+                                     previous_pin_coords=None if same_circle else last["pin_coords"])
+            on_miss = warm_start
+        calculated_image=result_cache.cached_calculate_thread(tc,self.result_cache,limit=2000,on_miss=on_miss)
+        self._last_solution = {
+            "path": self.image_app._path,
+            "pins": list(tc._selected_pins),
+            "num_pins": self.num_pins,
+            "start_angle": self.image_app.circle.start_angle,
+            "shape": self.image_app.circle.shape,
+            "pin_coords": tc.pin_coords,
+        }
+        # matplotlib is imported only when preview is shown, it is slow to import
+        from matplotlib import pyplot as plt
         plt.imshow(calculated_image,cmap='gray')
         plt.show()
         calculated_image.save("thread_art.jpg")
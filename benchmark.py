@@ -0,0 +1,100 @@
+import argparse
+import subprocess
+import sys
+import time
+import numpy as np
+import kernels
+import metrics
+import thread_calculator
+
+"""
+Benchmark and parity check of kernel backends.
+Every available backend solves the same image with the same pin layout,
+results must be identical to the NumPy backend.
+    python benchmark.py example.png --pins 200 --lines 1000
+Quality (MSE, PSNR, blurred perceptual MSE) of every result is printed as well,
+with --metrics the metrics are tracked incrementally during the timed solve:
+    python benchmark.py example.png --metrics
+Cold start of the engine and of the GUI entry point:
+    python benchmark.py --startup
+"""
+
+STARTUP_MODULES = ("thread_calculator", "main")
+
+
+def load_image(path, size=thread_calculator.thread_calculator.IMAGE_SIZE):
+    from PIL import Image
+
+    image = Image.open(path).convert("L")
+    side = min(image.width, image.height)
+    return image.crop((0, 0, side, side)).resize((size, size), resample=Image.BICUBIC)
+
+
+def solve(image, backend, num_of_pins, lines, seed=0, track_metrics=False):
+    kernels.set_backend(backend)
+    tc = thread_calculator.thread_calculator(image, 0, num_of_pins, seed=seed)
+    if track_metrics:
+        tc.track_metrics()
+    start = time.perf_counter()
+    tc.calculate_thread(limit=lines)
+    return tc, time.perf_counter() - start
+
+
+def measure_startup(modules=STARTUP_MODULES, repeats=5):
+    """
+    Wall time of importing every module in a fresh interpreter, best of repeats.
+    Returns:
+        dict: module -> seconds, "python" is bare interpreter start
+    """
+    timings = {}
+    for module in ("python",) + tuple(modules):
+        code = "pass" if module == "python" else f"import {module}"
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", code], capture_output=True)
+            best = min(best, time.perf_counter() - start)
+        timings[module] = best if result.returncode == 0 else None
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and parity check of kernel backends")
+    parser.add_argument("image", nargs="?", default="example.png")
+    parser.add_argument("--pins", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=1000)
+    parser.add_argument("--metrics", action="store_true", help="track quality metrics while solving")
+    parser.add_argument("--startup", action="store_true", help="measure cold start instead of solving")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        for module, seconds in measure_startup().items():
+            print(f"{module:<18} {'import failed' if seconds is None else f'{seconds * 1000:8.1f} ms'}")
+        return 0
+
+    image = load_image(args.image)
+    results = {}
+    for backend in kernels.BACKENDS:
+        # first short run compiles JIT kernels so compilation is not measured
+        solve(image, backend, args.pins, 2)
+        results[backend] = solve(image, backend, args.pins, args.lines, track_metrics=args.metrics)
+
+    reference, reference_time = results["numpy"]
+    ok = True
+    print(f"{'backend':<8} {'lines':>6} {'seconds':>9} {'speedup':>8} {'mse':>9} {'psnr':>7} {'blur mse':>9}  parity")
+    for backend, (tc, seconds) in results.items():
+        # untracked results are measured once after solving
+        quality = tc._metrics or metrics.IncrementalMetrics(tc.vector, tc._residual)
+        same_pins = tc._selected_pins == reference._selected_pins
+        residual_diff = float(np.max(np.abs(tc._residual - reference._residual)))
+        ok &= same_pins and residual_diff == 0.0
+        parity = "ok" if same_pins and residual_diff == 0.0 else f"FAIL (pins equal: {same_pins}, residual diff: {residual_diff})"
+        print(f"{backend:<8} {len(tc._selected_pins) - 1:>6} {seconds:>9.2f} {reference_time / seconds:>7.2f}x "
+              f"{quality.mse:>9.1f} {quality.psnr:>7.2f} {quality.perceptual_mse:>9.1f}  {parity}")
+    if not kernels.HAVE_NUMBA:
+        print("numba not installed, only NumPy backend measured (pip install numba)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
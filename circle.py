@@ -1,7 +1,11 @@
 import logging
 import math
+import pin_layout
 logger = logging.getLogger(__name__)
 
+# circle and square are defined by their diameter, rectangle by two opposite corners
+FRAME_SHAPES = ("circle", "square", "rectangle")
+
 
 class Circle:
     """
@@ -14,7 +18,7 @@ class Circle:
         self.canvas = canvas
         self.get_image_display_info = get_image_display_info_callback
         self.num_pins = None
-
+        self.shape = "circle"
 
         # for dragging points (these are always in CANVAS coordinates)
         self.diameter_point1_orig_image_coords = (0.0, 0.0)
@@ -40,6 +44,36 @@ class Circle:
     def set_num_pins(self, num_pins):
         self.num_pins = num_pins
 
+    def set_shape(self, shape):
+        if shape not in FRAME_SHAPES:
+            raise ValueError(f"Shape must be one of {FRAME_SHAPES}")
+        self.shape = shape
+
+    def _frame_bounds(self, x1, y1, x2, y2):
+        """(left, top, right, bottom) of the frame defined by the two control points"""
+        if self.shape == "rectangle":
+            return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+        center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+        radius = math.sqrt((x2 - x1)**2 + (y2 - y1)**2) / 2
+        return center_x - radius, center_y - radius, center_x + radius, center_y + radius
+
+    def frame_bounds(self):
+        """(left, top, right, bottom) of the frame in original image coordinates"""
+        return self._frame_bounds(*self.diameter_point1_orig_image_coords, *self.diameter_point2_orig_image_coords)
+
+    def pin_layout(self, size):
+        """
+        pin_layout.PinLayout of the frame in size x size image prepared for calculation,
+        None for circle which thread_calculator places itself
+        """
+        if self.shape == "circle" or self.num_pins is None:
+            return None
+        left, top, right, bottom = self.frame_bounds()
+        longer_side = max(right - left, bottom - top, 1e-9)
+        width = max(1, round(size * (right - left) / longer_side))
+        height = max(1, round(size * (bottom - top) / longer_side))
+        return pin_layout.rectangle(self.num_pins, width, height, size)
+
     def reset_default_diameter_points(self):
         """
         Sets default diameter points in *original image coordinates* based on initial canvas proportions.
@@ -136,6 +170,10 @@ class Circle:
             self.diameter_point2_orig_image_coords[0], self.diameter_point2_orig_image_coords[1]
         )
 
+        if self.shape != "circle":
+            self._draw_rectangle_frame(x1_canvas, y1_canvas, x2_canvas, y2_canvas)
+            return
+
         # Calculate the circle's center and radius based on the two diameter points (now in canvas coords)
         center_x_canvas = (x1_canvas + x2_canvas) / 2
         center_y_canvas = (y1_canvas + y2_canvas) / 2
@@ -183,6 +221,28 @@ class Circle:
                                         pin_x + pin_dot_size, pin_y + pin_dot_size,
                                         self._other_circles, tags="circle_elements")
 
+    def _draw_rectangle_frame(self, x1_canvas, y1_canvas, x2_canvas, y2_canvas):
+        """Draws square or rectangular frame, its control points and pins spread along its sides."""
+        left, top, right, bottom = self._frame_bounds(x1_canvas, y1_canvas, x2_canvas, y2_canvas)
+        self.canvas.create_rectangle(left, top, right, bottom, outline="gray", width=1, tags="circle_elements")
+
+        point_size = 6
+        for (x, y), style in (((x1_canvas, y1_canvas), self._circle1), ((x2_canvas, y2_canvas), self._circle2)):
+            self.canvas.create_oval(x - point_size, y - point_size, x + point_size, y + point_size,
+                                    **style, tags="circle_elements")
+
+        self.pin_coords = []
+        if right - left <= 0 or bottom - top <= 0 or self.num_pins is None:
+            return
+        self.start_angle = 0
+        layout = pin_layout.polygon([(left, top), (right, top), (right, bottom), (left, bottom)], self.num_pins)
+        pin_dot_size = 2
+        for pin_x, pin_y in layout.coords.tolist():
+            self.pin_coords.append((pin_x, pin_y))
+            self.canvas.create_oval(pin_x - pin_dot_size, pin_y - pin_dot_size,
+                                    pin_x + pin_dot_size, pin_y + pin_dot_size,
+                                    self._other_circles, tags="circle_elements")
+
     def on_button_press(self, event):
         point_size = 5
         tolerance = 15
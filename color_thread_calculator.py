@@ -0,0 +1,313 @@
+import os
+import numpy as np
+import thread_profile
+import thread_calculator
+import pin_sequence
+import pin_layout
+
+# black, white, red, blue
+DEFAULT_PALETTE = ((0, 0, 0), (255, 255, 255), (200, 30, 30), (30, 50, 180))
+
+
+class color_thread_calculator(thread_calculator.thread_calculator):
+    """
+    Class for calculating colored thread vector from image,
+    every step chooses both the next pin and the color of thread
+    """
+    # result_cache entries store pins only, colors would be lost
+    cacheable = False
+
+    def __init__(self, image, start_angle, num_of_pins, palette=DEFAULT_PALETTE,
+                 background=(255, 255, 255), profile=thread_profile.trapezoidal_profile, layout=None, seed=None):
+        """
+        Args:
+            image (_type_): image to calculate threads, image need to be of size 1000x1000
+            start_angle (_type_): angle of first pin
+            num_of_pins (_type_): number of pins
+            palette (_type_): RGB colors of available threads
+            background (_type_): RGB color of the board under threads
+            profile (_type_): profile of thread, default is trapezoidal
+            layout (_type_): pin_layout.PinLayout of non circular frame
+            seed (_type_): seed of pin position noise, same seed gives the same pin layout
+        """
+        super().__init__(image, start_angle, num_of_pins, profile, seed=seed, layout=layout)
+        self.palette = np.array(palette, dtype=np.float32).reshape(-1, 3)
+        self.background = np.array(background, dtype=np.float32)
+        self.target_rgb = np.array(image.convert("RGB"), dtype=np.float32)
+        # signed per channel residual: target color minus color on the board
+        self._residual_rgb = self.target_rgb - self.background
+        self._selected_colors = []
+
+    @property
+    def output_rgb(self):
+        """colors of drawn threads, derived from the residual"""
+        current = self.target_rgb - self._residual_rgb
+        return np.clip(current, 0, 255).astype(np.uint8)
+
+    def calculate_thread(self, draw=False, limit=2000, save_pins=False, pins_path="selected_pins.txt", start_pin=0,
+                         progress=None, exporters=()):
+        """
+        main function for calculating colored threads, arguments are the same as of thread_calculator.calculate_thread
+        Args:
+            save_pins (bool): save selected pins and colors to pins_path as "i.\tpin\tcolor" lines,
+                .tpin paths get pins in binary format and colors in <name>_colors.txt
+            progress (_type_): called as progress(line, limit, pin, None) after every drawn line,
+                returning False stops the calculation
+            exporters (_type_): open exporters.StreamingExporter objects, every pin is appended to them
+        """
+        from PIL import Image
+        current_pin = start_pin
+        self._close_pins_mask = self._build_close_pins_mask()
+        binary_writer = None
+        if save_pins and pins_path.endswith(".tpin"):
+            binary_writer = pin_sequence.PinSequenceWriter(pins_path, self.pin_sequence_header())
+        writers = ([binary_writer] if binary_writer else []) + list(exporters)
+        # stays False when progress callback stops the calculation or it fails, see result_cache
+        self._finished = False
+        try:
+            for writer in writers:
+                writer.extend(self._selected_pins)
+            no_more_lines = False
+            for w in range(limit):
+                new_line = self._find_next_pin_and_color(current_pin)
+                self._selected_pins.append(current_pin)
+                for writer in writers:
+                    writer.append(current_pin)
+                if new_line is None:
+                    print("end")
+                    no_more_lines = True
+                    self._finished = True
+                    break
+                pin1, pin2, color_idx = new_line
+                self._selected_colors.append(color_idx)
+                self._mark_line_drawn(pin1, pin2)
+                self._color_line(pin1, pin2, color_idx)
+                if draw and not w % 40:
+                    Image.fromarray(self.output_rgb).save("output.png")
+                current_pin = pin2
+                if progress is not None and progress(w + 1, limit, current_pin, None) is False:
+                    print("stopped")
+                    break
+            else:
+                # limit reached
+                self._finished = True
+            if not no_more_lines:
+                # last line ends at current_pin
+                self._selected_pins.append(current_pin)
+                for writer in writers:
+                    writer.append(current_pin)
+        finally:
+            # pins selected before an error are written out, caller closes exporters
+            for writer in writers:
+                if writer is binary_writer:
+                    writer.close()
+                else:
+                    writer.flush()
+        if binary_writer:
+            self._write_colors(os.path.splitext(pins_path)[0] + "_colors.txt")
+        elif save_pins:
+            self._write_colors(pins_path, with_pins=True)
+
+        return Image.fromarray(self.output_rgb)
+
+    def _write_colors(self, path, with_pins=False, pins=None, colors=None):
+        """one line per step, color of thread going from the pin of that step to the next one"""
+        pins = self._selected_pins if pins is None else pins
+        colors = self._selected_colors if colors is None else colors
+        with open(path, "w") as file:
+            for i, pin in enumerate(pins):
+                color = f"\t{colors[i]}" if i < len(colors) else ""
+                file.write(f"{i}.\t{pin}{color}\n" if with_pins else f"{i}.{color}\n")
+
+    def set_importance_map(self, weights):
+        """importance maps weight the grayscale residual, colored lines are scored on all channels"""
+        if weights is not None:
+            raise ValueError("Importance maps are not supported for colored threads.")
+
+    def set_perceptual_scoring(self, sigma=None):
+        """perceptual scoring keeps blurred grayscale residual, colored lines are scored on all channels"""
+        if sigma is not None:
+            raise ValueError("Perceptual scoring is not supported for colored threads.")
+
+    def track_metrics(self, *args, **kwargs):
+        raise ValueError("Metrics are tracked on the grayscale residual, they are not supported for colored threads.")
+
+    def calculate_threads(self, num_paths=2, schedule="round_robin", draw=False, limit=2000, save_pins=False):
+        """
+        Colored version of thread_calculator.calculate_threads, heads choose pin and color
+        one after another so every head sees lines drawn before it.
+        Pin sequence of every path is stored in self._selected_paths, colors of its lines in self._selected_path_colors
+        """
+        from PIL import Image
+        if schedule not in ("round_robin", "best_gain"):
+            raise ValueError("schedule must be 'round_robin' or 'best_gain'")
+        self._close_pins_mask = self._build_close_pins_mask()
+        heads = [i * self.num_of_pins // num_paths for i in range(num_paths)]
+        self._selected_paths = [[pin] for pin in heads]
+        self._selected_path_colors = [[] for _ in heads]
+        active = list(range(num_paths))
+        drawn = 0
+        while drawn < limit and active:
+            if schedule == "best_gain":
+                lines = [self._best_line_and_color(heads[path]) for path in active]
+                best = int(np.argmax([gain for _, gain in lines]))
+                if lines[best][0] is None:
+                    break
+                order = [(active[best], lines[best][0])]
+            else:
+                order = [(path, None) for path in active]
+            for path, new_line in order:
+                if drawn >= limit:
+                    break
+                if new_line is None:
+                    # lines drawn by heads before this one changed the residual
+                    new_line, _ = self._best_line_and_color(heads[path])
+                if new_line is None:
+                    active.remove(path)
+                    continue
+                pin1, pin2, color_idx = new_line
+                self._mark_line_drawn(pin1, pin2)
+                self._color_line(pin1, pin2, color_idx)
+                heads[path] = pin2
+                self._selected_paths[path].append(pin2)
+                self._selected_path_colors[path].append(color_idx)
+                drawn += 1
+                if draw and not drawn % 40:
+                    Image.fromarray(self.output_rgb).save("output.png")
+        if not active or (schedule == "best_gain" and drawn < limit):
+            print("end")
+        if save_pins:
+            for path, (pins, colors) in enumerate(zip(self._selected_paths, self._selected_path_colors)):
+                self._write_colors(f"selected_pins_{path}.txt", True, pins, colors)
+
+        return Image.fromarray(self.output_rgb)
+
+    def warm_start(self, previous_pins, previous_num_of_pins=None, previous_start_angle=None, repair_lines=200, draw=False,
+                   save_pins=False, pins_path="selected_pins.txt", previous_pin_coords=None, exporters=(), limit=2000,
+                   previous_colors=None):
+        """
+        Colored version of thread_calculator.warm_start.
+        Previous lines are replayed in order with their colors, then at most repair_lines lines are added.
+        Colored threads cover each other in the order they are drawn, so replayed lines can not be taken
+        out again and pins are not pruned as in the grayscale version.
+        Args:
+            previous_colors (_type_): color index of every previous line,
+                when not given every replayed line gets its best color
+        """
+        if previous_num_of_pins is None:
+            previous_num_of_pins = self.num_of_pins
+        if previous_start_angle is None:
+            previous_start_angle = self.start_angle
+        self._close_pins_mask = self._build_close_pins_mask()
+
+        def remap(pin):
+            if previous_pin_coords is not None:
+                return pin_layout.nearest_pins([pin], previous_pin_coords, self.pin_coords)[0]
+            return self.remap_pins([pin], previous_num_of_pins, previous_start_angle, self.num_of_pins, self.start_angle)[0]
+
+        # pins are remapped one by one so every line keeps its color
+        path = [remap(previous_pins[0])] if len(previous_pins) else [0]
+        colors = []
+        for i, pin in enumerate(previous_pins[1:]):
+            if len(path) > limit:
+                break
+            pin = remap(pin)
+            if pin == path[-1] or not self._line_allowed(path[-1], pin):
+                continue
+            if previous_colors is not None:
+                color_idx = int(previous_colors[i])
+            else:
+                color_idx = int(np.argmax(self._calculate_color_gains(path[-1], np.array([pin]))[0]))
+            self._mark_line_drawn(path[-1], pin)
+            self._color_line(path[-1], pin, color_idx)
+            path.append(pin)
+            colors.append(color_idx)
+
+        self._selected_pins = path[:-1]
+        self._selected_colors = colors
+        repair_lines = max(0, min(repair_lines, limit - (len(path) - 1)))
+        return self.calculate_thread(draw=draw, limit=repair_lines, save_pins=save_pins, pins_path=pins_path,
+                                     start_pin=path[-1], exporters=exporters)
+
+    def refine(self, time_budget=10.0, draw=False):
+        """
+        Colored threads cover each other in the order they are drawn, a line in the middle of the sequence
+        can not be removed or moved without redrawing everything after it, so local search is not possible.
+        """
+        raise ValueError("refine is not supported for colored threads, lines can not be removed once covered.")
+
+    def _color_line(self, pin1_idx: int, pin2_idx: int, color_idx: int):
+        """draws colored line, thread covers the board proportionally to its density"""
+        y_idx, x_idx, darkness = self._line_stamp(pin1_idx, pin2_idx)
+        coverage = (darkness / 255)[:, None]
+        current = self.target_rgb[y_idx, x_idx] - self._residual_rgb[y_idx, x_idx]
+        self._residual_rgb[y_idx, x_idx] -= coverage * (self.palette[color_idx] - current)
+
+    def _calculate_color_gains(self, pin1_idx: int, candidates: np.ndarray) -> np.ndarray:
+        """
+        Calculates reduction of squared color error for every candidate pin and every palette color.
+        Pixels of the chords are gathered once, colors only enter through small per chord sums
+        so scoring cost does not grow with palette size.
+        Returns:
+            np.ndarray: gains of shape (len(candidates), len(palette))
+        """
+        chord, y, x = self._chord_samples(np.full(candidates.size, pin1_idx), candidates)
+        error = self._residual_rgb[y, x]
+        current = self.target_rgb[y, x] - error
+        n = candidates.size
+
+        def per_chord(values):
+            return np.stack([np.bincount(chord, weights=values[:, c], minlength=n) for c in range(values.shape[1])], axis=1)
+
+        sum_error = per_chord(error)
+        sum_current = per_chord(current)
+        sum_error_current = np.bincount(chord, weights=np.sum(error * current, axis=1), minlength=n)
+        sum_current_sq = np.bincount(chord, weights=np.sum(current**2, axis=1), minlength=n)
+        lengths = np.bincount(chord, minlength=n)
+
+        # new error is e - d*(color - current), gain = 2d*e.(color-current) - d^2*|color-current|^2
+        d = self._thread_profile.max_density
+        colors = self.palette
+        colors_sq = np.sum(colors**2, axis=1)
+        linear = sum_error @ colors.T - sum_error_current[:, None]
+        quadratic = lengths[:, None] * colors_sq[None, :] - 2 * sum_current @ colors.T + sum_current_sq[:, None]
+        return 2 * d * linear - d**2 * quadratic
+
+    def _best_line_and_color(self, current_pin_idx: int):
+        """
+        Returns:
+            tuple: ((current_pin_idx, best_next_pin_idx, color_idx) or None if no line improves the image, its gain)
+        """
+        candidates = self._candidate_pins(current_pin_idx)
+        if candidates.size == 0:
+            return None, 0.0
+        gains = self._calculate_color_gains(current_pin_idx, candidates)
+        best = int(np.argmax(gains))
+        pin_pos, color_idx = np.unravel_index(best, gains.shape)
+        if gains[pin_pos, color_idx] <= 0:
+            return None, 0.0
+        return (current_pin_idx, int(candidates[pin_pos]), int(color_idx)), float(gains[pin_pos, color_idx])
+
+    def _find_next_pin_and_color(self, current_pin_idx: int) -> tuple | None:
+        """
+        Finds the best line and thread color from current_pin_idx.
+        Returns a tuple (current_pin_idx, best_next_pin_idx, color_idx) or None if no line improves the image.
+        """
+        return self._best_line_and_color(current_pin_idx)[0]
+
+
+if __name__ == "__main__":
+    import sys
+    from PIL import Image
+
+    image_path = sys.argv[1]
+    image = Image.open(image_path).convert("RGB")
+    size = thread_calculator.thread_calculator.IMAGE_SIZE
+
+    if image.width != size or image.height != size:
+        image = image.resize((min(image.width, image.height), min(image.width, image.height)), resample=Image.BICUBIC)
+        image = image.resize((size, size), resample=Image.BICUBIC)
+
+    tc = color_thread_calculator(image, 0, 200, seed=0)
+    calculated_image = tc.calculate_thread(draw=True, limit=4000)
+    calculated_image.save("output.png")
@@ -0,0 +1,250 @@
+import json
+import os
+import numpy as np
+
+"""
+Streaming exporters of pin sequences into build instructions and vector formats:
+    .svg          thread path over pins, for previews and printing
+    .csv          numbered step list (step, from pin, to pin, x, y) for builders
+    .json         the same step list as JSON
+    .gcode / .nc  G-code like commands for a stringing machine
+Pins are written as they are appended, only the previous pin is kept,
+so memory does not grow with the number of lines.
+Coordinates are physical: pin coordinates of the solver image times units_per_pixel.
+"""
+
+
+def units_per_pixel(layout, image_size: int, frame_size=None) -> float:
+    """
+    Physical size of one solver pixel.
+    Args:
+        layout (_type_): pin_layout.PinLayout, its units_per_pixel is used when frame_size is not given
+        image_size (int): size of the solver image
+        frame_size (_type_): physical size of the solver image side (e.g. diameter of circular frame)
+    Returns:
+        float: units per pixel, 1.0 (coordinates in pixels) when unknown
+    """
+    if frame_size is not None:
+        return frame_size / image_size
+    if layout is not None and layout.units_per_pixel:
+        return layout.units_per_pixel
+    return 1.0
+
+
+class StreamingExporter:
+    """
+    Base of exporters, subclasses write header, one step for every appended pin and footer.
+    Used like pin_sequence.PinSequenceWriter: append / extend / close or as context manager.
+    """
+    def __init__(self, path, pin_coords, units_per_pixel=1.0, unit="mm"):
+        """
+        Args:
+            pin_coords (_type_): (num_of_pins, 2) pin coordinates in pixels of the solver image
+            units_per_pixel (float): physical size of one solver pixel, see units_per_pixel()
+            unit (str): name of physical unit
+        """
+        self.path = path
+        self.coords = np.asarray(pin_coords, dtype=np.float64) * units_per_pixel
+        self.units_per_pixel = units_per_pixel
+        self.unit = unit
+        self._step = 0
+        self._previous_pin = None
+        self._file = open(path, "w", newline="")
+        self._write_header()
+
+    def _write_header(self):
+        pass
+
+    def _write_step(self, step: int, previous_pin, pin: int, x: float, y: float):
+        raise NotImplementedError
+
+    def _write_footer(self):
+        pass
+
+    def append(self, pin: int):
+        pin = int(pin)
+        if not (0 <= pin < len(self.coords)):
+            raise ValueError(f"Pin {pin} out of range [0, {len(self.coords)}).")
+        x, y = self.coords[pin]
+        self._write_step(self._step, self._previous_pin, pin, float(x), float(y))
+        self._previous_pin = pin
+        self._step += 1
+
+    def extend(self, pins):
+        for pin in pins:
+            self.append(pin)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._write_footer()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SvgExporter(StreamingExporter):
+    """
+    Pins as dots and the whole thread as one path, streamed point by point into its d attribute.
+    """
+    def __init__(self, path, pin_coords, units_per_pixel=1.0, unit="mm", stroke_width=None, opacity=0.2, pin_radius=None):
+        """
+        Args:
+            stroke_width (_type_): width of thread, default one solver pixel
+            opacity (float): opacity of thread, overlapping threads get darker
+            pin_radius (_type_): radius of pin dots, default two solver pixels, 0 hides pins
+        """
+        self.stroke_width = units_per_pixel if stroke_width is None else stroke_width
+        self.opacity = opacity
+        self.pin_radius = 2 * units_per_pixel if pin_radius is None else pin_radius
+        super().__init__(path, pin_coords, units_per_pixel, unit)
+
+    def _write_header(self):
+        margin = max(self.pin_radius, self.stroke_width)
+        low = self.coords.min(axis=0) - margin
+        size = self.coords.max(axis=0) + margin - low
+        write = self._file.write
+        write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{size[0]:.3f}{self.unit}" height="{size[1]:.3f}{self.unit}" '
+              f'viewBox="{low[0]:.3f} {low[1]:.3f} {size[0]:.3f} {size[1]:.3f}">\n')
+        if self.pin_radius > 0:
+            write('<g fill="gray">\n')
+            for x, y in self.coords.tolist():
+                write(f'<circle cx="{x:.3f}" cy="{y:.3f}" r="{self.pin_radius:.3f}"/>\n')
+            write('</g>\n')
+        write(f'<path fill="none" stroke="black" stroke-width="{self.stroke_width:.3f}" stroke-opacity="{self.opacity}" '
+              f'stroke-linejoin="round" d="')
+
+    def _write_step(self, step, previous_pin, pin, x, y):
+        self._file.write(f'{"M" if step == 0 else " L"}{x:.3f} {y:.3f}')
+        if step % 8 == 7:
+            self._file.write("\n")
+
+    def _write_footer(self):
+        self._file.write('"/>\n</svg>\n')
+
+
+class CsvStepExporter(StreamingExporter):
+    """numbered step list, one row per pin: step,from_pin,to_pin,x,y"""
+    def _write_header(self):
+        self._file.write(f"step,from_pin,to_pin,x_{self.unit},y_{self.unit}\n")
+
+    def _write_step(self, step, previous_pin, pin, x, y):
+        self._file.write(f"{step},{'' if previous_pin is None else previous_pin},{pin},{x:.3f},{y:.3f}\n")
+
+
+class JsonStepExporter(StreamingExporter):
+    """
+    {"unit": ..., "num_of_pins": ..., "pins": [[x, y], ...], "steps": [{"step", "from_pin", "to_pin", "x", "y"}, ...]}
+    """
+    def _write_header(self):
+        pins = json.dumps([[round(x, 3), round(y, 3)] for x, y in self.coords.tolist()])
+        self._file.write(f'{{"unit": {json.dumps(self.unit)}, "num_of_pins": {len(self.coords)},\n"pins": {pins},\n"steps": [')
+
+    def _write_step(self, step, previous_pin, pin, x, y):
+        entry = {"step": step, "from_pin": previous_pin, "to_pin": pin, "x": round(x, 3), "y": round(y, 3)}
+        self._file.write(("\n" if step == 0 else ",\n") + json.dumps(entry))
+
+    def _write_footer(self):
+        self._file.write("\n]}\n")
+
+
+class GcodeExporter(StreamingExporter):
+    """
+    G-code like commands, rapid move to the first pin and linear move around every next pin.
+    Machine Y axis goes up, origin is the lower left corner of the pins bounding box.
+    """
+    def __init__(self, path, pin_coords, units_per_pixel=1.0, unit="mm", feed_rate=3000):
+        """
+        Args:
+            feed_rate (_type_): feed rate of linear moves in units per minute
+        """
+        self.feed_rate = feed_rate
+        super().__init__(path, pin_coords, units_per_pixel, unit)
+        self.coords = np.stack([self.coords[:, 0] - self.coords[:, 0].min(), self.coords[:, 1].max() - self.coords[:, 1]], axis=1)
+
+    def _write_header(self):
+        write = self._file.write
+        write(f"; thread art, {len(self.coords)} pins\n")
+        units = {"mm": "G21", "in": "G20"}.get(self.unit)
+        write(f"{units} ; units {self.unit}\n" if units else f"; units {self.unit}\n")
+        write("G90 ; absolute positioning\n")
+
+    def _write_step(self, step, previous_pin, pin, x, y):
+        if step == 0:
+            self._file.write(f"G0 X{x:.3f} Y{y:.3f} ; start at pin {pin}\n")
+        else:
+            self._file.write(f"G1 X{x:.3f} Y{y:.3f} F{self.feed_rate} ; step {step} pin {pin}\n")
+
+    def _write_footer(self):
+        self._file.write(f"M2 ; end, {max(self._step - 1, 0)} lines\n")
+
+
+EXPORTERS = {
+    ".svg": SvgExporter,
+    ".csv": CsvStepExporter,
+    ".json": JsonStepExporter,
+    ".gcode": GcodeExporter,
+    ".nc": GcodeExporter,
+}
+
+
+def open_exporter(path, pin_coords, units_per_pixel=1.0, unit="mm", **kwargs) -> StreamingExporter:
+    """exporter chosen by extension of path, see EXPORTERS"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXPORTERS:
+        raise ValueError(f"Unknown export format {extension}, choose from {tuple(EXPORTERS)}")
+    return EXPORTERS[extension](path, pin_coords, units_per_pixel, unit, **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+    import pin_layout
+    import pin_sequence
+    import thread_calculator
+
+    parser = argparse.ArgumentParser(description="Export saved pin sequence as SVG, step list or G-code")
+    parser.add_argument("pins", help="pin sequence, .tpin or selected_pins.txt")
+    parser.add_argument("out", nargs="+", help=f"output files, formats by extension: {', '.join(EXPORTERS)}")
+    parser.add_argument("--num-pins", type=int, help="number of pins, required for text sequences")
+    parser.add_argument("--start-angle", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, help="seed of pin layout used when solving")
+    parser.add_argument("--layout", help="csv with pins of non circular frame, see pin_layout.load_csv")
+    parser.add_argument("--frame-size", type=float, help="physical size of the image side, e.g. frame diameter")
+    parser.add_argument("--unit", default="mm")
+    args = parser.parse_args()
+
+    size = thread_calculator.thread_calculator.IMAGE_SIZE
+    if args.pins.endswith(".tpin"):
+        header, pins = pin_sequence.read_pins(args.pins)
+    else:
+        if args.num_pins is None and not args.layout:
+            parser.error("--num-pins or --layout is required for text sequences")
+        pins = pin_sequence.read_text_pins(args.pins)
+        header = pin_sequence.PinSequenceHeader(args.num_pins or 0)
+    if args.layout:
+        layout = pin_layout.load_csv(args.layout, size)
+    else:
+        layout = pin_layout.circle(header.num_of_pins, args.start_angle, size, args.seed)
+    if header.layout_hash and header.layout_hash != pin_sequence.layout_hash(layout.coords):
+        print("Warning: pin layout does not match the one used for solving, check --layout, --start-angle and --seed")
+
+    scale = units_per_pixel(layout, size, args.frame_size)
+    unit = args.unit if scale != 1.0 or args.frame_size else "px"
+    exporters = [open_exporter(path, layout.coords, scale, unit) for path in args.out]
+    try:
+        # pins are streamed from the memory mapped file
+        for pin in pins:
+            for exporter in exporters:
+                exporter.append(pin)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    print(f"Exported {max(len(pins) - 1, 0)} lines to {', '.join(args.out)}")
@@ -1,5 +1,4 @@
 # image.py
-import math
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageDraw
@@ -182,32 +181,27 @@ class AppImage:
             return None # Changed: Return None if no image
 
         logger.debug("Preparing image for calculation")
-        # Changed: Use circle's original image coordinates
-        x1_orig, y1_orig = self.circle.diameter_point1_orig_image_coords
-        x2_orig, y2_orig = self.circle.diameter_point2_orig_image_coords
-        
-        center_x_orig = (x1_orig + x2_orig) / 2
-        center_y_orig = (y1_orig + y2_orig) / 2
-        radius_orig = math.sqrt((x2_orig - x1_orig)**2 + (y2_orig - y1_orig)**2) / 2
-        
-        # cut out the circle from the image
+        # frame bounds in original image coordinates
+        frame_left, frame_top, frame_right, frame_bottom = self.circle.frame_bounds()
+
+        # cut out the frame from the image
         mask = Image.new('L', self._original_image.size, 0)
         draw = ImageDraw.Draw(mask)
-        # Changed: Use original image coordinates for ellipse
-        draw.ellipse((center_x_orig-radius_orig, center_y_orig-radius_orig, center_x_orig+radius_orig, center_y_orig+radius_orig), fill=255)
+        if self.circle.shape == "circle":
+            draw.ellipse((frame_left, frame_top, frame_right, frame_bottom), fill=255)
+        else:
+            draw.rectangle((frame_left, frame_top, frame_right, frame_bottom), fill=255)
         
         # apply mask
         background_color_rgb=Image.new("RGB", self._original_image.size, (0,0,0))
         image_rgb_with_black_corners=Image.composite(self._original_image.convert("RGB"),background_color_rgb,mask)
         cut_image=image_rgb_with_black_corners.convert("RGBA")
         cut_image.putalpha(mask)
-        # Cut out the square from the image, circumscribing the circle
-        square_size_orig = 2*radius_orig # Changed: Use original image radius
-        # Changed: Use original image coordinates for crop bounds
-        left = max(0, int(center_x_orig - square_size_orig / 2))
-        top = max(0, int(center_y_orig - square_size_orig / 2))
-        right = min(self._original_image.width, int(center_x_orig + square_size_orig / 2))
-        bottom = min(self._original_image.height, int(center_y_orig + square_size_orig / 2))
+        # Cut out the rectangle from the image, circumscribing the frame
+        left = max(0, int(frame_left))
+        top = max(0, int(frame_top))
+        right = min(self._original_image.width, int(frame_right))
+        bottom = min(self._original_image.height, int(frame_bottom))
 
         # Changed: Ensure crop coordinates are valid
         if left >= right: right = left + 1
@@ -215,6 +209,15 @@ class AppImage:
 
         # Changed: Crop the already masked image
         cut_image = cut_image.crop((left, top, right, bottom))
+        frame_width = max(right, int(frame_right)) - min(left, int(frame_left))
+        frame_height = max(bottom, int(frame_bottom)) - min(top, int(frame_top))
+        if cut_image.size != (frame_width, frame_height) or frame_width != frame_height:
+            # frame is centered in a square, also where it reaches out of the image, so resizing keeps its aspect ratio
+            side = max(frame_width, frame_height)
+            square = Image.new("RGBA", (side, side), (0, 0, 0, 0))
+            square.paste(cut_image, ((side - frame_width) // 2 + left - min(left, int(frame_left)),
+                                     (side - frame_height) // 2 + top - min(top, int(frame_top))))
+            cut_image = square
         logger.info("Image prepared for calculation")
         return cut_image
 
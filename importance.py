@@ -0,0 +1,51 @@
+import numpy as np
+
+"""
+Importance maps
+float arrays of image size which weight how much every pixel counts when scoring a thread.
+Computed once before solving and passed to thread_calculator.set_importance_map.
+"""
+
+
+def _as_array(image) -> np.ndarray:
+    if isinstance(image, np.ndarray):
+        return image.astype(np.float32)
+    return np.array(image.convert("L"), dtype=np.float32)
+
+
+def sobel_magnitude(image) -> np.ndarray:
+    """
+    Sobel gradient magnitude of grayscale image (PIL image or 2D array).
+    """
+    a = np.pad(_as_array(image), 1, mode="edge")
+    gx = (a[:-2, 2:] + 2 * a[1:-1, 2:] + a[2:, 2:]) - (a[:-2, :-2] + 2 * a[1:-1, :-2] + a[2:, :-2])
+    gy = (a[2:, :-2] + 2 * a[2:, 1:-1] + a[2:, 2:]) - (a[:-2, :-2] + 2 * a[:-2, 1:-1] + a[:-2, 2:])
+    return np.hypot(gx, gy)
+
+
+def edge_map(image, strength: float = 1.0) -> np.ndarray:
+    """
+    Weights in range [1, 1+strength], edges of the image get the biggest weight.
+    """
+    if strength < 0:
+        raise ValueError("strength must be greater or equal 0.")
+    magnitude = sobel_magnitude(image)
+    peak = magnitude.max()
+    if peak == 0:
+        return np.ones_like(magnitude)
+    return (1.0 + strength * magnitude / peak).astype(np.float32)
+
+
+def ellipse_mask(shape, center, radii, inside: float = 2.0, outside: float = 1.0) -> np.ndarray:
+    """
+    Weights for a region of interest (e.g. a face), inside the ellipse pixels count more.
+    Args:
+        shape (tuple): (height, width) of the map
+        center (tuple): (x, y) of the ellipse center
+        radii (tuple): (rx, ry) of the ellipse
+    """
+    y, x = np.ogrid[:shape[0], :shape[1]]
+    cx, cy = center
+    rx, ry = radii
+    inside_mask = ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 <= 1.0
+    return np.where(inside_mask, inside, outside).astype(np.float32)
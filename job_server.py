@@ -0,0 +1,457 @@
+import base64
+import heapq
+import itertools
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Local job server for thread art rendering
+Jobs (image + parameters) are queued by priority and run in separate solver processes.
+At most max_workers processes run at once and their estimated memory stays under memory_budget.
+HTTP API (JSON):
+    POST   /jobs                 {"image": base64 image, "num_pins": 150, "limit": 2000, "priority": 0, ...}
+                                 -> {"id": job id}
+    GET    /jobs/<id>            state, progress and pins of the job
+    GET    /jobs/<id>/events     newline delimited JSON events streamed until the job finishes
+    GET    /jobs/<id>/result.png rendered image of finished job
+    DELETE /jobs/<id>            cancels queued or running job
+    python job_server.py --port 8765 --workers 2 --memory-mb 2048
+"""
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_PARAMS = {"num_pins": 150, "limit": 2000, "start_angle": 0.0, "seed": 0, "thread_width": 1.0}
+
+# seconds a cancelled worker gets to stop on its own before it is terminated
+CANCEL_GRACE = 5.0
+
+
+def estimate_job_memory(params: dict) -> int:
+    """rough peak memory of one solver process in bytes"""
+    import thread_calculator
+
+    size = thread_calculator.thread_calculator.IMAGE_SIZE
+    num_pins = int(params.get("num_pins", DEFAULT_PARAMS["num_pins"]))
+    limit = int(params.get("limit", DEFAULT_PARAMS["limit"]))
+    # image buffers, pin matrices, cached chord stamps and interpreter with numpy
+    return size * size * 16 + num_pins * num_pins * 2 + limit * size * 16 + 80 * 1024 * 1024
+
+
+def _run_job(job_id: str, image_bytes: bytes, params: dict, messages, cancelled):
+    """
+    solver process, reports progress and result through messages queue,
+    stops after the current line when cancelled event is set
+    """
+    import io
+    from PIL import Image
+    import thread_calculator
+
+    try:
+        size = thread_calculator.thread_calculator.IMAGE_SIZE
+        image = Image.open(io.BytesIO(image_bytes)).convert("L")
+        side = min(image.width, image.height)
+        image = image.crop((0, 0, side, side)).resize((size, size), resample=Image.BICUBIC)
+        tc = thread_calculator.thread_calculator(image, float(params["start_angle"]), int(params["num_pins"]), seed=params["seed"])
+        tc._thread_width = float(params["thread_width"])
+        tc.track_metrics()
+
+        def progress(line, limit, pin, metrics):
+            if cancelled.is_set():
+                return False
+            # line goes from the last selected pin to pin
+            messages.put(("progress", job_id, {"line": line, "limit": limit, "from_pin": tc._selected_pins[-1], "pin": pin,
+                                                "metrics": metrics}))
+
+        result = tc.calculate_thread(limit=int(params["limit"]), progress=progress)
+        if cancelled.is_set():
+            return
+        png = io.BytesIO()
+        result.save(png, format="PNG")
+        messages.put(("done", job_id, {"pins": [int(pin) for pin in tc._selected_pins], "png": png.getvalue()}))
+    except Exception as e:
+        messages.put(("error", job_id, {"error": f"{type(e).__name__}: {e}"}))
+
+
+class Job:
+    def __init__(self, job_id, image_bytes, params, priority):
+        self.id = job_id
+        self.image_bytes = image_bytes
+        self.params = params
+        self.priority = priority
+        self.memory = estimate_job_memory(params)
+        self.state = QUEUED
+        self.line = 0
+        self.pins = []
+        self.metrics = None
+        self.png = None
+        self.error = None
+        self.events = []
+        self.process = None
+        self.cancelled = None
+        self.submitted = time.time()
+
+    def to_dict(self, with_pins=True):
+        result = {
+            "id": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "line": self.line,
+            "limit": int(self.params["limit"]),
+            "params": self.params,
+            "metrics": self.metrics,
+        }
+        if with_pins:
+            result["pins"] = self.pins
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+class JobServer:
+    """
+    Priority queue of jobs and bounded pool of solver processes.
+    """
+    def __init__(self, max_workers=2, memory_budget=2 * 1024**3, max_finished_jobs=100):
+        """
+        Args:
+            max_workers (int): maximal number of solver processes
+            memory_budget (int): bytes, sum of estimated memory of running jobs stays under it
+                (single job bigger than the budget still runs alone)
+            max_finished_jobs (int): finished jobs kept with their results and events,
+                older ones are forgotten
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.max_finished_jobs = max_finished_jobs
+        self._context = multiprocessing.get_context("spawn")
+        self._messages = self._context.Queue()
+        self._jobs = {}
+        self._finished = deque()
+        # (deadline, process, memory) of cancelled workers which did not stop yet
+        self._stopping_workers = []
+        self._queue = []
+        self._counter = itertools.count()
+        self._changed = threading.Condition()
+        self._stopping = False
+        self._threads = [
+            threading.Thread(target=self._schedule_loop, daemon=True),
+            threading.Thread(target=self._message_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # --- public API ---
+
+    def submit(self, image_bytes: bytes, params=None, priority=0) -> str:
+        """queues job, higher priority runs first, returns job id"""
+        params = {**DEFAULT_PARAMS, **(params or {})}
+        job = Job(uuid.uuid4().hex, image_bytes, params, priority)
+        with self._changed:
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (-priority, next(self._counter), job.id))
+            self._add_event(job, {"type": "queued"})
+        logger.info(f"Job {job.id} queued with priority {priority}")
+        return job.id
+
+    def cancel(self, job_id: str) -> bool:
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+            self._stop_worker(job)
+            self._finish(job, CANCELLED)
+        logger.info(f"Job {job_id} cancelled")
+        return True
+
+    def status(self, job_id: str, with_pins=True):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.to_dict(with_pins)
+
+    def jobs(self):
+        with self._changed:
+            return [job.to_dict(with_pins=False) for job in self._jobs.values()]
+
+    def result_png(self, job_id: str):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.png
+
+    def events(self, job_id: str, timeout=None):
+        """
+        Yields events of the job from the first one until the job finishes.
+        """
+        index = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._changed:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                while index >= len(job.events) and job.state not in FINISHED_STATES:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._changed.wait(remaining)
+                new_events = job.events[index:]
+                index += len(new_events)
+                finished = job.state in FINISHED_STATES
+            yield from new_events
+            if finished and index >= len(job.events):
+                return
+
+    def wait(self, job_id: str, timeout=None) -> dict:
+        for _ in self.events(job_id, timeout):
+            pass
+        return self.status(job_id)
+
+    def shutdown(self, timeout=CANCEL_GRACE):
+        """cancels all jobs, waits at most timeout seconds for workers to stop and stops the threads"""
+        with self._changed:
+            self._stopping = True
+            for job in list(self._jobs.values()):
+                if job.state not in FINISHED_STATES:
+                    self._stop_worker(job)
+                    self._finish(job, CANCELLED)
+            self._changed.notify_all()
+        self._threads[0].join()
+        deadline = time.monotonic() + timeout
+        for _, process, _ in self._stopping_workers:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._stopping_workers = []
+        self._messages.put(None)
+        self._threads[1].join()
+        self._messages.close()
+        self._messages.join_thread()
+
+    # --- internals, called with self._changed held ---
+
+    def _add_event(self, job, event):
+        event = {"job": job.id, "time": time.time(), **event}
+        job.events.append(event)
+        self._changed.notify_all()
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.process = None
+        job.cancelled = None
+        # image is not needed anymore
+        job.image_bytes = None
+        self._add_event(job, {"type": state, **({"error": error} if error else {})})
+        self._finished.append(job.id)
+        while len(self._finished) > self.max_finished_jobs:
+            self._jobs.pop(self._finished.popleft(), None)
+
+    def _stop_worker(self, job):
+        """
+        asks worker of the job to stop after its current line, terminating it right away
+        could corrupt the shared messages queue, it is terminated only after CANCEL_GRACE
+        """
+        if job.process is None:
+            return
+        job.cancelled.set()
+        self._stopping_workers.append((time.monotonic() + CANCEL_GRACE, job.process, job.memory))
+
+    def _reap_stopping_workers(self):
+        alive = []
+        for deadline, process, memory in self._stopping_workers:
+            if process.is_alive() and time.monotonic() >= deadline:
+                logger.warning(f"Worker {process.pid} did not stop in {CANCEL_GRACE} s, terminating")
+                process.terminate()
+            if process.is_alive():
+                alive.append((deadline, process, memory))
+            else:
+                process.join()
+        self._stopping_workers = alive
+
+    def _running(self):
+        return [job for job in self._jobs.values() if job.state == RUNNING]
+
+    def _can_start(self, job):
+        # cancelled workers still hold their memory until they stop
+        memories = [j.memory for j in self._running()] + [memory for _, _, memory in self._stopping_workers]
+        if len(memories) >= self.max_workers:
+            return False
+        return not memories or sum(memories) + job.memory <= self.memory_budget
+
+    def _schedule_loop(self):
+        with self._changed:
+            while not self._stopping:
+                self._reap_stopping_workers()
+                # drop cancelled (or already forgotten) jobs from the top of the queue
+                while self._queue and getattr(self._jobs.get(self._queue[0][2]), "state", None) != QUEUED:
+                    heapq.heappop(self._queue)
+                if self._queue and self._can_start(self._jobs[self._queue[0][2]]):
+                    job = self._jobs[heapq.heappop(self._queue)[2]]
+                    job.cancelled = self._context.Event()
+                    job.process = self._context.Process(target=_run_job, daemon=True,
+                                                        args=(job.id, job.image_bytes, job.params, self._messages, job.cancelled))
+                    try:
+                        job.process.start()
+                    except Exception as e:
+                        self._finish(job, FAILED, f"worker did not start: {e}")
+                        continue
+                    job.state = RUNNING
+                    self._add_event(job, {"type": "started"})
+                    logger.info(f"Job {job.id} started")
+                    continue
+                # processes which died without reporting
+                for job in self._running():
+                    if job.process is not None and job.process.exitcode not in (None, 0):
+                        self._finish(job, FAILED, f"worker exited with code {job.process.exitcode}")
+                self._changed.wait(0.5)
+
+    def _message_loop(self):
+        while True:
+            message = self._messages.get()
+            if message is None:
+                return
+            kind, job_id, data = message
+            with self._changed:
+                job = self._jobs.get(job_id)
+                if job is None or job.state != RUNNING:
+                    continue
+                if kind == "progress":
+                    job.line = data["line"]
+                    job.metrics = data["metrics"]
+                    if not job.pins:
+                        job.pins.append(data["from_pin"])
+                    job.pins.append(data["pin"])
+                    self._add_event(job, {"type": "progress", **data})
+                elif kind == "done":
+                    job.pins = data["pins"]
+                    job.png = data["png"]
+                    job.line = len(job.pins) - 1
+                    self._add_event(job, {"type": "pins", "pins": job.pins})
+                    self._finish(job, DONE)
+                    logger.info(f"Job {job_id} done")
+                else:
+                    self._finish(job, FAILED, data["error"])
+                    logger.warning(f"Job {job_id} failed: {data['error']}")
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = "ThreadArtJobServer/1"
+
+    @property
+    def jobs(self) -> JobServer:
+        return self.server.job_server
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path_parts(self):
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def do_POST(self):
+        if self._path_parts() != ["jobs"]:
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            image_bytes = base64.b64decode(request.pop("image"))
+            priority = int(request.pop("priority", 0))
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send_json({"error": f"bad request: {e}"}, 400)
+        unknown = set(request) - set(DEFAULT_PARAMS)
+        if unknown:
+            return self._send_json({"error": f"unknown parameters: {sorted(unknown)}"}, 400)
+        job_id = self.jobs.submit(image_bytes, request, priority)
+        self._send_json({"id": job_id}, 201)
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ["jobs"]:
+            return self._send_json(self.jobs.jobs())
+        if len(parts) < 2 or parts[0] != "jobs" or self.jobs.status(parts[1], with_pins=False) is None:
+            return self._send_json({"error": "not found"}, 404)
+        job_id = parts[1]
+        if len(parts) == 2:
+            return self._send_json(self.jobs.status(job_id))
+        if parts[2:] == ["result.png"]:
+            png = self.jobs.result_png(job_id)
+            if png is None:
+                return self._send_json({"error": "result not ready"}, 409)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(png)))
+            self.end_headers()
+            self.wfile.write(png)
+            return
+        if parts[2:] == ["events"]:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for event in self.jobs.events(job_id):
+                    line = json.dumps(event).encode() + b"\n"
+                    self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+        self._send_json({"error": "not found"}, 404)
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send_json({"error": "not found"}, 404)
+        if self.jobs.status(parts[1], with_pins=False) is None:
+            return self._send_json({"error": "not found"}, 404)
+        self._send_json({"cancelled": self.jobs.cancel(parts[1])})
+
+
+def make_http_server(job_server: JobServer, host="127.0.0.1", port=8765) -> ThreadingHTTPServer:
+    """HTTP front end of job_server, port 0 picks a free port"""
+    httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+    httpd.daemon_threads = True
+    httpd.job_server = job_server
+    return httpd
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Thread art job server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--memory-mb", type=int, default=2048, help="memory budget of running jobs")
+    args = parser.parse_args()
+
+    job_server = JobServer(args.workers, args.memory_mb * 1024 * 1024)
+    httpd = make_http_server(job_server, args.host, args.port)
+    logger.info(f"Listening on http://{args.host}:{httpd.server_port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        job_server.shutdown()
@@ -0,0 +1,146 @@
+import importlib.util
+import math
+import os
+import numpy as np
+
+"""
+Hot inner loops of the solver: gathering residual along chords for scoring
+and scattering thread stamps into the residual.
+Numba compiled versions (CPU only) are used when numba is installed,
+otherwise the NumPy versions. Both give the same results.
+Backend can be forced with THREAD_ART_KERNELS=numpy or set_backend().
+"""
+
+# numba is slow to import, it is imported and kernels are compiled on first use
+HAVE_NUMBA = importlib.util.find_spec("numba") is not None
+_numba_kernels = None
+
+BACKENDS = ("numba", "numpy") if HAVE_NUMBA else ("numpy",)
+_backend = os.environ.get("THREAD_ART_KERNELS", BACKENDS[0])
+if _backend not in BACKENDS:
+    _backend = "numpy"
+
+
+def set_backend(name: str):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Backend {name} not available, choose from {BACKENDS}")
+    _backend = name
+
+
+def get_backend() -> str:
+    return _backend
+
+
+# --- NumPy ---
+
+def chord_samples(p0: np.ndarray, p1: np.ndarray):
+    """
+    Samples many chords at once, int(length) points per chord like np.linspace.
+    Args:
+        p0 (np.ndarray): (n, 2) x, y of chord starts
+        p1 (np.ndarray): (n, 2) x, y of chord ends
+    Returns:
+        tuple: (chord index of every sample, y indices, x indices)
+    """
+    delta = (p1 - p0).astype(np.float64)
+    lengths = np.hypot(delta[:, 0], delta[:, 1]).astype(int)
+    chord = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    k = np.arange(chord.size) - starts[chord]
+    # same arithmetic as np.linspace, last sample is exactly the end pin
+    step = delta / np.maximum(lengths - 1, 1)[:, None]
+    points = p0[chord] + k[:, None] * step[chord]
+    last = (k == (lengths[chord] - 1)) & (lengths[chord] > 1)
+    points[last] = p1[chord[last]]
+    points = points.astype(np.int16)
+    return chord, points[:, 1], points[:, 0]
+
+
+def _score_chords_numpy(residual, importance, p0, p1):
+    chord, y, x = chord_samples(p0, p1)
+    values = residual[y, x]
+    if importance is not None:
+        values = values * importance[y, x]
+    return np.bincount(chord, weights=values, minlength=len(p0))
+
+
+def _subtract_stamp_numpy(residual, y_idx, x_idx, values):
+    # pixels of one stamp are unique so fancy indexed subtraction is safe
+    residual[y_idx, x_idx] -= values
+
+
+# --- Numba ---
+
+def _get_numba_kernels():
+    global _numba_kernels
+    if _numba_kernels is not None:
+        return _numba_kernels
+    import numba
+
+    @numba.njit(cache=True)
+    def score_chords_kernel(residual, importance, use_importance, p0, p1, out):
+        for c in range(p0.shape[0]):
+            x0, y0 = p0[c, 0], p0[c, 1]
+            x1, y1 = p1[c, 0], p1[c, 1]
+            dx = float(x1 - x0)
+            dy = float(y1 - y0)
+            length = int(math.hypot(dx, dy))
+            div = length - 1 if length > 1 else 1
+            step_x = dx / div
+            step_y = dy / div
+            total = 0.0
+            for k in range(length):
+                if k == length - 1 and length > 1:
+                    x, y = x1, y1
+                else:
+                    x = int(x0 + k * step_x)
+                    y = int(y0 + k * step_y)
+                if use_importance:
+                    total += residual[y, x] * importance[y, x]
+                else:
+                    total += residual[y, x]
+            out[c] = total
+
+    @numba.njit(cache=True)
+    def subtract_stamp_kernel(residual, y_idx, x_idx, values):
+        for i in range(values.shape[0]):
+            residual[y_idx[i], x_idx[i]] -= values[i]
+
+    _numba_kernels = (score_chords_kernel, subtract_stamp_kernel)
+    return _numba_kernels
+
+
+def _score_chords_numba(residual, importance, p0, p1):
+    out = np.zeros(len(p0), dtype=np.float64)
+    use_importance = importance is not None
+    if not use_importance:
+        importance = residual[:1, :1]
+    score_chords_kernel, _ = _get_numba_kernels()
+    score_chords_kernel(residual, importance, use_importance,
+                         np.ascontiguousarray(p0, dtype=np.int64), np.ascontiguousarray(p1, dtype=np.int64), out)
+    return out
+
+
+def _subtract_stamp_numba(residual, y_idx, x_idx, values):
+    _, subtract_stamp_kernel = _get_numba_kernels()
+    subtract_stamp_kernel(residual, y_idx, x_idx, values)
+
+
+# --- dispatch ---
+
+def score_chords(residual: np.ndarray, importance, p0: np.ndarray, p1: np.ndarray) -> np.ndarray:
+    """
+    Sum of residual (times importance if given) sampled along every chord.
+    """
+    if _backend == "numba":
+        return _score_chords_numba(residual, importance, p0, p1)
+    return _score_chords_numpy(residual, importance, p0, p1)
+
+
+def subtract_stamp(residual: np.ndarray, y_idx: np.ndarray, x_idx: np.ndarray, values: np.ndarray):
+    """residual[y, x] -= values in place, pixels must be unique"""
+    if _backend == "numba":
+        _subtract_stamp_numba(residual, y_idx, x_idx, values)
+    else:
+        _subtract_stamp_numpy(residual, y_idx, x_idx, values)
@@ -0,0 +1,88 @@
+import math
+import numpy as np
+
+"""
+Low-pass (gaussian) filtering of whole images and of sparse thread stamps.
+Thread art is looked at from a distance, blurred images are closer to what the eye sees.
+Blur uses zero padding so it is linear: blurred image of many stamps is the sum
+of blurred stamps, which lets blurred images be updated line by line.
+"""
+
+# in pixels of the 1000x1000 image
+PERCEPTUAL_SIGMA = 2.0
+
+_kernels = {}
+
+
+def gaussian_kernel(sigma: float) -> np.ndarray:
+    """normalized 1D gaussian of radius ceil(3*sigma), cached for every sigma"""
+    kernel = _kernels.get(sigma)
+    if kernel is None:
+        if sigma <= 0:
+            raise ValueError("sigma must be greater than 0.")
+        radius = max(1, math.ceil(3 * sigma))
+        offsets = np.arange(-radius, radius + 1)
+        kernel = np.exp(-(offsets**2) / (2 * sigma**2))
+        kernel = _kernels[sigma] = (kernel / kernel.sum()).astype(np.float32)
+    return kernel
+
+
+def _convolve_axis(array: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+    """same size convolution along one axis, outside of array is zero"""
+    radius = len(kernel) // 2
+    size = array.shape[axis]
+    padding = [(0, 0)] * array.ndim
+    padding[axis] = (radius, radius)
+    padded = np.pad(array, padding)
+    index = [slice(None)] * array.ndim
+    result = np.zeros(array.shape, dtype=np.float32)
+    for k, weight in enumerate(kernel):
+        index[axis] = slice(k, k + size)
+        result += weight * padded[tuple(index)]
+    return result
+
+
+def blur(image, sigma: float = PERCEPTUAL_SIGMA) -> np.ndarray:
+    """gaussian blur of whole image as float32"""
+    kernel = gaussian_kernel(sigma)
+    image = np.asarray(image, dtype=np.float32)
+    return _convolve_axis(_convolve_axis(image, kernel, 0), kernel, 1)
+
+
+def blurred_stamp_patches(y_idx: np.ndarray, x_idx: np.ndarray, values: np.ndarray, shape: tuple,
+                          sigma: float = PERCEPTUAL_SIGMA, chunk: int = 64):
+    """
+    Blurs a sparse stamp piece by piece, pixels of the stamp must be unique.
+    Stamp is split into chunks along its longer side and every chunk is blurred in a small dense patch,
+    so the cost follows the length of the line instead of its bounding box.
+    Args:
+        shape (tuple): shape of the image, parts of patches outside are dropped
+        chunk (int): length of chunks in pixels
+    Yields:
+        tuple: (y slice, x slice, patch), blurred stamp is the sum of patches added at their slices,
+            patches of neighbouring chunks overlap
+    """
+    if len(values) == 0:
+        return
+    radius = len(gaussian_kernel(sigma)) // 2
+    y_idx = np.asarray(y_idx, dtype=np.intp)
+    x_idx = np.asarray(x_idx, dtype=np.intp)
+    major = x_idx if np.ptp(x_idx) >= np.ptp(y_idx) else y_idx
+    chunk_id = (major - major.min()) // chunk
+    order = np.argsort(chunk_id, kind="stable")
+    y_idx, x_idx, chunk_id = y_idx[order], x_idx[order], chunk_id[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(chunk_id) != 0])
+    part = np.cumsum(np.r_[False, np.diff(chunk_id) != 0])
+    # all chunks are blurred at once in patches of the same size
+    y0 = np.minimum.reduceat(y_idx, starts) - radius
+    x0 = np.minimum.reduceat(x_idx, starts) - radius
+    height = int(np.max(np.maximum.reduceat(y_idx, starts) - y0)) + radius + 1
+    width = int(np.max(np.maximum.reduceat(x_idx, starts) - x0)) + radius + 1
+    patches = np.zeros((len(starts), height, width), dtype=np.float32)
+    patches[part, y_idx - y0[part], x_idx - x0[part]] = np.asarray(values)[order]
+    kernel = gaussian_kernel(sigma)
+    patches = _convolve_axis(_convolve_axis(patches, kernel, 1), kernel, 2)
+    for patch, top, left in zip(patches, y0.tolist(), x0.tolist()):
+        bottom, right = min(top + height, shape[0]), min(left + width, shape[1])
+        rows, cols = max(top, 0), max(left, 0)
+        yield slice(rows, bottom), slice(cols, right), patch[rows - top:bottom - top, cols - left:right - left]
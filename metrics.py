@@ -0,0 +1,97 @@
+import math
+import numpy as np
+import lowpass
+
+"""
+Quality metrics of thread image kept up to date while solving.
+Every drawn line changes only pixels of its stamp, so metrics are updated
+from those pixels instead of passing over the whole image.
+Darkness is measured like output_vector of thread_calculator: 0 white, 255 black,
+darkness achieved by threads is clipped to 0..255.
+"""
+
+
+class IncrementalMetrics:
+    """
+    Tracks:
+        mse: mean squared error between target and achieved darkness
+        perceptual_mse: mean squared error of gaussian blurred (lowpass) target and achieved darkness
+        coverage: histogram of achieved darkness
+    """
+    def __init__(self, target: np.ndarray, residual: np.ndarray, sigma: float = lowpass.PERCEPTUAL_SIGMA, bins: int = 16):
+        """
+        Args:
+            target (np.ndarray): target darkness
+            residual (np.ndarray): target darkness minus darkness applied by threads
+            sigma (float): sigma of blur of perceptual error in pixels
+            bins (int): number of coverage histogram bins, spread evenly over 0..256
+        """
+        self.target = np.asarray(target, dtype=np.float32)
+        self.sigma = sigma
+        self.bins = bins
+        self.bin_edges = np.linspace(0, 256, bins + 1)
+        self.recompute(residual)
+
+    def _achieved(self, target, residual):
+        return np.clip(target - residual, 0, 255)
+
+    def _coverage_of(self, achieved) -> np.ndarray:
+        bin_idx = np.minimum((achieved * (self.bins / 256)).astype(np.intp), self.bins - 1)
+        return np.bincount(bin_idx.ravel(), minlength=self.bins)
+
+    def recompute(self, residual: np.ndarray):
+        """full pass over the image, also drops rounding errors accumulated by updates"""
+        achieved = self._achieved(self.target, np.asarray(residual, dtype=np.float32))
+        error = self.target - achieved
+        self._squared_error = float(np.sum(np.square(error, dtype=np.float64)))
+        self._blurred_error = lowpass.blur(error, self.sigma)
+        self._blurred_squared_error = float(np.sum(np.square(self._blurred_error, dtype=np.float64)))
+        self._coverage = self._coverage_of(achieved)
+
+    def update(self, y_idx: np.ndarray, x_idx: np.ndarray, residual_before: np.ndarray, residual_after: np.ndarray):
+        """
+        Updates metrics after residual of pixels (y_idx, x_idx) changed, pixels must be unique.
+        """
+        target = self.target[y_idx, x_idx]
+        achieved_before = self._achieved(target, residual_before)
+        achieved_after = self._achieved(target, residual_after)
+        error_before = target - achieved_before
+        error_after = target - achieved_after
+        self._squared_error += float(np.sum(np.square(error_after, dtype=np.float64) - np.square(error_before, dtype=np.float64)))
+        self._coverage += self._coverage_of(achieved_after) - self._coverage_of(achieved_before)
+
+        # overlapping patches are applied one after another so the sum stays exact
+        for rows, cols, patch in lowpass.blurred_stamp_patches(y_idx, x_idx, error_after - error_before,
+                                                               self.target.shape, self.sigma):
+            region = self._blurred_error[rows, cols]
+            self._blurred_squared_error -= float(np.sum(np.square(region, dtype=np.float64)))
+            region += patch
+            self._blurred_squared_error += float(np.sum(np.square(region, dtype=np.float64)))
+
+    @property
+    def mse(self) -> float:
+        return self._squared_error / self.target.size
+
+    @property
+    def perceptual_mse(self) -> float:
+        return self._blurred_squared_error / self.target.size
+
+    @property
+    def psnr(self) -> float:
+        """peak signal to noise ratio in dB, higher is better"""
+        mse = self.mse
+        return 10 * math.log10(255**2 / mse) if mse > 0 else math.inf
+
+    @property
+    def coverage(self) -> np.ndarray:
+        """number of pixels in every darkness bin, see bin_edges"""
+        return self._coverage.copy()
+
+    def summary(self) -> dict:
+        """metrics as plain values, e.g. for progress reports"""
+        return {
+            "mse": self.mse,
+            "psnr": self.psnr,
+            "perceptual_mse": self.perceptual_mse,
+            "coverage": self._coverage.tolist(),
+        }
@@ -0,0 +1,172 @@
+import csv
+import random
+from typing import NamedTuple
+import numpy as np
+
+"""
+Pin layouts of frames (circle, ellipse, rectangle, polygon or loaded from csv).
+Layout is the list of pin coordinates in pixels of the solver image, ordered along the frame,
+and the straight sides of the frame every pin lies on.
+Lines between pins on the same side would run along the frame, they are excluded when solving.
+"""
+
+
+class PinLayout(NamedTuple):
+    # (num_of_pins, 2) int x, y in pixels of the solver image, ordered along the frame
+    coords: np.ndarray
+    # (num_of_pins,) bit mask of straight sides every pin lies on, 0 for pins on curves
+    sides: np.ndarray
+    name: str = "custom"
+    # physical size of one solver pixel (e.g. mm), 0 if unknown
+    units_per_pixel: float = 0.0
+
+
+def circle_pin_coords(num_of_pins: int, start_angle: float, size: int, seed=None) -> np.ndarray:
+    """
+    Pin coordinates on circle inscribed in size x size image,
+    same seed gives the same layout
+    """
+    rng=random.Random(seed)
+    pin_coords = np.zeros((num_of_pins, 2), dtype=int)
+    center_x = center_y = radius = size / 2
+    for i in range(num_of_pins):
+        angle = start_angle + i * 2 * np.pi / num_of_pins
+        x = int(center_x + radius * np.cos(angle))
+        y = int(center_y + radius * np.sin(angle))
+        # adding noise to minimize Moire effect
+        rand=int(size*0.008)
+        if x > rand:
+            x -= rng.randint(1, rand)
+        elif x < (2 * radius - rand):
+            x += rng.randint(1, rand)
+        if y > rand:
+            y -= rng.randint(1, rand)
+        elif y < (2 * radius - rand):
+            y += rng.randint(1, rand)
+        pin_coords[i] = (x, y)
+    return pin_coords
+
+
+def circle(num_of_pins: int, start_angle: float, size: int, seed=None) -> PinLayout:
+    """circle inscribed in size x size image, see circle_pin_coords"""
+    return PinLayout(circle_pin_coords(num_of_pins, start_angle, size, seed), np.zeros(num_of_pins, dtype=np.int64), "circle")
+
+
+def _to_pixels(points, size=None) -> np.ndarray:
+    coords = np.rint(points).astype(int)
+    if size is not None:
+        coords = np.clip(coords, 0, size - 1)
+    return coords
+
+
+def ellipse(num_of_pins: int, width: float, height: float, start_angle: float, size: int) -> PinLayout:
+    """
+    Ellipse of width x height pixels centered in size x size image,
+    pins are spread evenly along its circumference starting at start_angle.
+    """
+    center = (size - 1) / 2
+    angles = start_angle + np.linspace(0, 2 * np.pi, 4097)
+    points = np.stack([center + (width - 1) / 2 * np.cos(angles), center + (height - 1) / 2 * np.sin(angles)], axis=1)
+    arc = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))])
+    pin_angles = np.interp(np.arange(num_of_pins) * arc[-1] / num_of_pins, arc, angles)
+    pins = np.stack([center + (width - 1) / 2 * np.cos(pin_angles), center + (height - 1) / 2 * np.sin(pin_angles)], axis=1)
+    return PinLayout(_to_pixels(pins, size), np.zeros(num_of_pins, dtype=np.int64), "ellipse")
+
+
+def polygon(vertices, num_of_pins: int, name: str = "polygon") -> PinLayout:
+    """
+    Pins spread evenly along closed polygon starting at its first vertex.
+    Args:
+        vertices (_type_): (n, 2) x, y of vertices in pixels of the solver image, at most 63
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    if not (3 <= len(vertices) <= 63):
+        raise ValueError("Polygon must have from 3 to 63 vertices.")
+    edges = np.roll(vertices, -1, axis=0) - vertices
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    cumulative = np.concatenate([[0.0], np.cumsum(lengths)])
+    positions = np.arange(num_of_pins) * cumulative[-1] / num_of_pins
+    edge = np.minimum(np.searchsorted(cumulative, positions, side="right") - 1, len(vertices) - 1)
+    offset = positions - cumulative[edge]
+    pins = vertices[edge] + edges[edge] * (offset / lengths[edge])[:, None]
+    sides = np.left_shift(np.int64(1), edge.astype(np.int64))
+    # pin on a vertex lies on both sides meeting there
+    at_vertex = offset < 1e-9 * cumulative[-1]
+    sides[at_vertex] |= np.left_shift(np.int64(1), ((edge[at_vertex] - 1) % len(vertices)).astype(np.int64))
+    return PinLayout(_to_pixels(pins), sides, name)
+
+
+def rectangle(num_of_pins: int, width: float, height: float, size: int) -> PinLayout:
+    """
+    Rectangle of width x height pixels centered in size x size image,
+    pins are spread evenly along its sides starting at top left corner, clockwise.
+    """
+    left, top = (size - width) / 2, (size - height) / 2
+    right, bottom = left + width - 1, top + height - 1
+    layout = polygon([(left, top), (right, top), (right, bottom), (left, bottom)], num_of_pins, "rectangle")
+    return layout._replace(coords=np.clip(layout.coords, 0, size - 1))
+
+
+def load_csv(path: str, size: int) -> PinLayout:
+    """
+    Loads pins measured on a real frame, one pin per row ordered along the frame:
+        x,y[,sides]
+    sides are indices of straight sides of the frame the pin lies on separated with ';' (e.g. 0;1 for corner),
+    empty for pins on curves. Header row is optional.
+    Coordinates are in any physical unit, they are scaled to fit size x size image keeping aspect ratio.
+    """
+    points, sides = [], []
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or not row[0].strip():
+                continue
+            try:
+                point = (float(row[0]), float(row[1]))
+            except ValueError:
+                if points:
+                    raise
+                # header
+                continue
+            points.append(point)
+            mask = 0
+            if len(row) > 2:
+                for side in row[2].split(";"):
+                    if side.strip():
+                        mask |= 1 << int(side)
+            sides.append(mask)
+    if len(points) < 2:
+        raise ValueError(f"{path} must contain at least 2 pins.")
+    points = np.array(points)
+    low, high = points.min(axis=0), points.max(axis=0)
+    extent = float(np.max(high - low)) or 1.0
+    scale = (size - 1) / extent
+    pixels = (points - low) * scale + ((size - 1) - (high - low) * scale) / 2
+    return PinLayout(_to_pixels(pixels, size), np.array(sides, dtype=np.int64), "csv", 1.0 / scale)
+
+
+def close_pins_mask(sides: np.ndarray, ignore_close_pins: int) -> np.ndarray:
+    """
+    mask of chords which can not be drawn: between pins closer than ignore_close_pins along the frame
+    (pins num_of_pins-1 and 0 are neighbours) and between pins on the same side of the frame
+    """
+    num_of_pins = len(sides)
+    idx = np.arange(num_of_pins)
+    diff = np.abs(idx[:, None] - idx[None, :])
+    mask = np.minimum(diff, num_of_pins - diff) < ignore_close_pins
+    mask |= (sides[:, None] & sides[None, :]) != 0
+    return mask
+
+
+def nearest_pins(pins, old_coords, new_coords) -> list:
+    """
+    Moves every pin of a sequence to the nearest pin of another layout,
+    repeated pins created by the mapping are dropped.
+    """
+    old_coords = np.asarray(old_coords, dtype=np.float64)
+    new_coords = np.asarray(new_coords, dtype=np.float64)
+    remapped = []
+    for pin in pins:
+        new_pin = int(np.argmin(np.sum((new_coords - old_coords[int(pin)])**2, axis=1)))
+        if not remapped or remapped[-1] != new_pin:
+            remapped.append(new_pin)
+    return remapped
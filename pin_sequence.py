@@ -0,0 +1,179 @@
+import hashlib
+import struct
+from typing import NamedTuple
+import numpy as np
+
+"""
+Compact binary pin sequence format (.tpin)
+little endian header followed by uint16 pin indices, one per step:
+    magic       4s   b"TPIN"
+    version     H
+    reserved    H
+    num_of_pins I    number of pins on the frame
+    layout_hash Q    hash of pin coordinates, see layout_hash()
+    profile     32s  name of thread profile, utf-8, zero padded
+    thread_width f
+Length of the sequence is given by the file size, so pins can be appended while solving.
+"""
+
+MAGIC = b"TPIN"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHIQ32sf")
+HEADER_SIZE = _HEADER.size
+PIN_DTYPE = np.dtype("<u2")
+
+
+class PinSequenceHeader(NamedTuple):
+    num_of_pins: int
+    layout_hash: int = 0
+    profile: str = ""
+    thread_width: float = 1.0
+
+
+def layout_hash(pin_coords) -> int:
+    """64 bit hash of pin coordinates, identifies the pin layout a sequence was made for"""
+    coords = np.ascontiguousarray(pin_coords, dtype=np.int64)
+    return int.from_bytes(hashlib.blake2b(coords.tobytes(), digest_size=8).digest(), "little")
+
+
+def profile_name(profile) -> str:
+    """
+    name of profile with its parameters for the header (thread_profile.ThreadProfile.name),
+    names longer than 32 bytes are cut and end with hash of the full profile key
+    """
+    name = getattr(profile, "name", None) or getattr(profile, "__name__", type(profile).__name__)
+    if len(name.encode("utf-8")) <= 32:
+        return name
+    key = profile.key() if hasattr(profile, "key") else name
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4).hexdigest()
+    return name.encode("utf-8")[:23].decode("utf-8", "ignore") + "#" + digest
+
+
+def _pack_header(header: PinSequenceHeader) -> bytes:
+    if not (0 < header.num_of_pins <= np.iinfo(PIN_DTYPE).max + 1):
+        raise ValueError("num_of_pins must be in range [1, 65536].")
+    profile = header.profile.encode("utf-8")[:32]
+    return _HEADER.pack(MAGIC, VERSION, 0, header.num_of_pins, header.layout_hash, profile, header.thread_width)
+
+
+def read_header(path) -> PinSequenceHeader:
+    with open(path, "rb") as file:
+        data = file.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"{path} is too short to be a pin sequence file")
+    magic, version, _, num_of_pins, hash_value, profile, thread_width = _HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a pin sequence file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported pin sequence version {version}")
+    return PinSequenceHeader(num_of_pins, hash_value, profile.rstrip(b"\0").decode("utf-8"), thread_width)
+
+
+def read_pins(path):
+    """
+    Memory maps pin sequence file, pins are not loaded until accessed.
+    Returns:
+        tuple: (PinSequenceHeader, read only np.memmap of uint16 pins)
+    """
+    header = read_header(path)
+    with open(path, "rb") as file:
+        file.seek(0, 2)
+        body_size = file.tell() - HEADER_SIZE
+    count = body_size // PIN_DTYPE.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=PIN_DTYPE)
+    return header, np.memmap(path, dtype=PIN_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+class PinSequenceWriter:
+    """
+    Streaming writer, pins are appended as they are produced.
+    Opening existing file with append=True continues the sequence.
+    """
+    def __init__(self, path, header: PinSequenceHeader, append=False, buffer_size=4096):
+        self.path = path
+        self.header = header
+        self._buffer = []
+        self._buffer_size = buffer_size
+        if append:
+            existing = read_header(path)
+            if existing.num_of_pins != header.num_of_pins or existing.layout_hash != header.layout_hash:
+                raise ValueError("Header of existing file does not match")
+            self._file = open(path, "ab")
+        else:
+            self._file = open(path, "wb")
+            self._file.write(_pack_header(header))
+
+    def append(self, pin: int):
+        if not (0 <= pin < self.header.num_of_pins):
+            raise ValueError(f"Pin {pin} out of range [0, {self.header.num_of_pins}).")
+        self._buffer.append(pin)
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def extend(self, pins):
+        for pin in pins:
+            self.append(int(pin))
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(np.asarray(self._buffer, dtype=PIN_DTYPE).tobytes())
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_pins(path, pins, header: PinSequenceHeader):
+    with PinSequenceWriter(path, header) as writer:
+        writer.extend(pins)
+
+
+def read_text_pins(path) -> list[int]:
+    """reads selected_pins.txt format, one "i.\\tpin" line per step"""
+    pins = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                pins.append(int(line.split()[1]))
+    return pins
+
+
+def write_text_pins(path, pins):
+    with open(path, "w") as file:
+        for i, pin in enumerate(pins):
+            file.write(f"{i}.\t{pin}\n")
+
+
+def text_to_binary(text_path, binary_path, header: PinSequenceHeader):
+    write_pins(binary_path, read_text_pins(text_path), header)
+
+
+def binary_to_text(binary_path, text_path):
+    _, pins = read_pins(binary_path)
+    write_text_pins(text_path, pins)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 4 or sys.argv[1] not in ("to-text", "to-bin") or (sys.argv[1] == "to-bin" and len(sys.argv) < 5):
+        print("Usage: python pin_sequence.py to-text <file.tpin> <file.txt>")
+        print("       python pin_sequence.py to-bin <file.txt> <file.tpin> <num_of_pins>")
+        sys.exit(1)
+
+    if sys.argv[1] == "to-text":
+        binary_to_text(sys.argv[2], sys.argv[3])
+    else:
+        text_to_binary(sys.argv[2], sys.argv[3], PinSequenceHeader(int(sys.argv[4])))
@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+import kernels
+import lowpass
+import metrics
+import renderer
+import thread_calculator
+
+"""
+Deterministic regression and parity checks of the solver, fast enough to run before every commit:
+    python regression.py            run all checks, exit code 1 on failure
+    python regression.py --update   store current pin sequences as golden results
+Small canonical images (downscaled example.png and synthetic ones) are solved with fixed seeds.
+Every fast path (kernel backends, batched scoring, cached stamps, incremental updates)
+is compared with a plain reference: pin sequences must be identical,
+or where floating point order differs, the error must stay within a bound.
+Golden pin sequences in regression_golden.json catch any change of results between commits,
+after intended changes bump thread_calculator.ENGINE_VERSION and run --update.
+"""
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression_golden.json")
+SIZE = 250
+NUM_OF_PINS = 60
+LINES = 150
+SEED = 1234
+# relative difference of squared residual error accepted when pin sequences differ
+ERROR_TOLERANCE = 0.01
+# mean relative gain lost by choosing lines with foo.py's Bresenham rasterization
+BRESENHAM_TOLERANCE = 0.05
+
+
+class _SmallCalculator(thread_calculator.thread_calculator):
+    # everything scales with image size, small images keep the checks fast
+    IMAGE_SIZE = SIZE
+
+
+def canonical_images():
+    """name -> grayscale PIL image of size SIZE"""
+    from PIL import Image
+
+    y, x = np.mgrid[0:SIZE, 0:SIZE] / (SIZE - 1)
+    radius = np.hypot(x - 0.5, y - 0.5)
+    images = {
+        "gradient": (255 * x).astype(np.uint8),
+        "rings": (127.5 + 127.5 * np.cos(radius * 40)).astype(np.uint8),
+        "disk": np.where(radius < 0.3, 30, 230).astype(np.uint8),
+    }
+    images = {name: Image.fromarray(array, mode="L") for name, array in images.items()}
+    example = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example.png")
+    if os.path.exists(example):
+        image = Image.open(example).convert("L")
+        side = min(image.width, image.height)
+        images["example"] = image.crop((0, 0, side, side)).resize((SIZE, SIZE), resample=Image.BICUBIC)
+    return images
+
+
+def solve(image, backend, lines=LINES):
+    kernels.set_backend(backend)
+    tc = _SmallCalculator(image, 0, NUM_OF_PINS, seed=SEED)
+    tc.calculate_thread(limit=lines)
+    return tc
+
+
+def reference_solve(image, lines=LINES):
+    """
+    Plain greedy solver: every chord sampled with np.linspace and scored one by one,
+    every line rasterized again without cache.
+    """
+    tc = _SmallCalculator(image, 0, NUM_OF_PINS, seed=SEED)
+    mask = tc._build_close_pins_mask()
+    usage = np.zeros((NUM_OF_PINS, NUM_OF_PINS), dtype=int)
+    residual = tc.vector.astype(np.float32)
+    pins = [0]
+    for _ in range(lines):
+        current = pins[-1]
+        best_pin, best_score = None, 0.0
+        for offset in range(NUM_OF_PINS):
+            pin = (current + offset) % NUM_OF_PINS
+            if mask[current, pin] or usage[current, pin] >= tc._max_line_reuse:
+                continue
+            (x0, y0), (x1, y1) = tc.pin_coords[current], tc.pin_coords[pin]
+            length = int(math.hypot(x1 - x0, y1 - y0))
+            x = np.linspace(x0, x1, length).astype(np.int16)
+            y = np.linspace(y0, y1, length).astype(np.int16)
+            score = float(np.sum(residual[y, x], dtype=np.float64))
+            if best_pin is None or score > best_score:
+                best_pin, best_score = pin, score
+        if best_pin is None or best_score <= 0:
+            break
+        usage[current, best_pin] += 1
+        usage[best_pin, current] += 1
+        _, y, x, darkness = thread_calculator.line_stamps(
+            tc.pin_coords[[current]], tc.pin_coords[[best_pin]], tc._thread_width, tc._thread_profile, (0, 0, SIZE, SIZE))
+        residual[y, x] -= darkness
+        pins.append(best_pin)
+    return pins, residual
+
+
+def squared_error(residual) -> float:
+    return float(np.sum(np.square(residual, dtype=np.float64)))
+
+
+def pins_hash(pins) -> str:
+    return hashlib.sha256(np.asarray(pins, dtype=np.int64).tobytes()).hexdigest()[:16]
+
+
+def compare_results(pins, residual, reference_pins, reference_residual):
+    """
+    Returns:
+        tuple: (passed, description)
+    """
+    if list(pins) == list(reference_pins):
+        difference = float(np.max(np.abs(residual - reference_residual)))
+        return difference <= 1e-3, f"same pins, residual diff {difference:.2g}"
+    error, reference_error = squared_error(residual), squared_error(reference_residual)
+    relative = abs(error - reference_error) / max(reference_error, 1e-12)
+    first = next(i for i, (a, b) in enumerate(zip(pins, reference_pins)) if a != b) if min(len(pins), len(reference_pins)) else 0
+    return relative <= ERROR_TOLERANCE, f"pins differ from step {first}, error diff {relative:.2%}"
+
+
+def bresenham_scores(residual, pin_coords, pins1, pins2):
+    """chord scores on pixels of foo.py's Bresenham line"""
+    import foo
+
+    scores = np.zeros(len(pins1))
+    for i, (pin1, pin2) in enumerate(zip(pins1, pins2)):
+        (x0, y0), (x1, y1) = pin_coords[pin1], pin_coords[pin2]
+        points = np.array(list(foo.thread_calculator.line_algorithm(int(x0), int(y0), int(x1), int(y1))))
+        scores[i] = np.sum(residual[points[:, 1], points[:, 0]], dtype=np.float64)
+    return scores
+
+
+class Checks:
+    def __init__(self):
+        self.results = []
+
+    def add(self, name, passed, detail=""):
+        self.results.append((name, passed))
+        print(f"{'ok  ' if passed else 'FAIL'} {name:<44} {detail}")
+
+    @property
+    def passed(self):
+        return all(passed for _, passed in self.results)
+
+
+def run(update=False) -> bool:
+    checks = Checks()
+    images = canonical_images()
+    golden = {}
+    if os.path.exists(GOLDEN_PATH):
+        with open(GOLDEN_PATH) as file:
+            golden = json.load(file)
+    new_golden = {"engine_version": thread_calculator.ENGINE_VERSION, "size": SIZE, "num_of_pins": NUM_OF_PINS,
+                  "lines": LINES, "seed": SEED, "pins": {}}
+
+    for name, image in images.items():
+        reference_pins, reference_residual = reference_solve(image)
+        results = {backend: solve(image, backend) for backend in kernels.BACKENDS}
+        numpy_tc = results["numpy"]
+        new_golden["pins"][name] = pins_hash(numpy_tc._selected_pins)
+
+        again = solve(image, "numpy")
+        checks.add(f"{name}: deterministic with seed", again._selected_pins == numpy_tc._selected_pins
+                   and np.array_equal(again._residual, numpy_tc._residual))
+        checks.add(f"{name}: engine vs reference", *compare_results(
+            numpy_tc._selected_pins, numpy_tc._residual, reference_pins, reference_residual))
+        for backend, tc in results.items():
+            if backend != "numpy":
+                same = tc._selected_pins == numpy_tc._selected_pins and np.array_equal(tc._residual, numpy_tc._residual)
+                checks.add(f"{name}: {backend} vs numpy backend", same, "identical" if same else "results differ")
+
+        # batched multi path scheduling with a single path is the plain greedy
+        kernels.set_backend("numpy")
+        paths_tc = _SmallCalculator(image, 0, NUM_OF_PINS, seed=SEED)
+        paths_tc.calculate_threads(num_paths=1, limit=LINES)
+        checks.add(f"{name}: calculate_threads(1) vs calculate_thread",
+                   paths_tc._selected_paths[0] == numpy_tc._selected_pins[:len(paths_tc._selected_paths[0])]
+                   and np.array_equal(paths_tc._residual, numpy_tc._residual))
+
+        # re-rendering from pins matches the solver image
+        rendered = renderer.render_pins(numpy_tc._selected_pins, numpy_tc.pin_coords, SIZE, source_size=SIZE,
+                                        thread_width=numpy_tc._thread_width)
+        difference = int(np.max(np.abs(rendered.astype(int) - numpy_tc.output_vector.astype(int))))
+        checks.add(f"{name}: renderer vs solver image", difference <= 1, f"max pixel diff {difference}")
+
+        if not update:
+            # stale or missing golden results fail, the gate must not be switched off silently
+            if golden.get("engine_version") != thread_calculator.ENGINE_VERSION:
+                checks.add(f"{name}: golden pin sequence", False, f"golden results stale (engine version "
+                           f"{golden.get('engine_version')}, current {thread_calculator.ENGINE_VERSION}), run --update")
+            elif name not in golden.get("pins", {}):
+                checks.add(f"{name}: golden pin sequence", False, "no golden result, run --update")
+            else:
+                same = golden["pins"][name] == new_golden["pins"][name]
+                checks.add(f"{name}: golden pin sequence", same, "" if same else "results changed, bump ENGINE_VERSION and --update if intended")
+
+    # incremental updates against full recomputation
+    image = images.get("example", images["rings"])
+    kernels.set_backend("numpy")
+    tc = _SmallCalculator(image, 0, NUM_OF_PINS, seed=SEED)
+    tc.track_metrics()
+    tc.set_perceptual_scoring()
+    tc.calculate_thread(limit=LINES)
+    tc.refine(time_budget=0.5)
+    full = metrics.IncrementalMetrics(tc.vector, tc._residual)
+    relative = max(abs(tc._metrics.mse - full.mse) / full.mse, abs(tc._metrics.perceptual_mse - full.perceptual_mse) / full.perceptual_mse)
+    checks.add("incremental metrics vs full pass", relative < 1e-6 and np.array_equal(tc._metrics.coverage, full.coverage),
+               f"relative diff {relative:.2g}")
+    blurred = lowpass.blur(tc._residual, tc._perceptual_sigma * math.sqrt(2))
+    difference = float(np.max(np.abs(blurred - tc._blurred_residual)))
+    checks.add("incremental blurred residual vs full blur", difference < 1e-2, f"max diff {difference:.2g}")
+
+    # foo.py rasterizes chords with Bresenham instead of sampling them, lines it would choose
+    # must lose on average at most BRESENHAM_TOLERANCE of the best gain
+    tc = solve(image, "numpy", lines=LINES // 3)
+    losses = []
+    for pin in range(NUM_OF_PINS):
+        candidates = tc._candidate_pins(pin)
+        sampled = tc._calculate_efficiencies(np.full(candidates.size, pin), candidates)
+        bresenham = bresenham_scores(tc._residual, tc.pin_coords, np.full(candidates.size, pin), candidates)
+        losses.append((sampled.max() - sampled[np.argmax(bresenham)]) / max(abs(sampled.max()), 1e-9))
+    loss = float(np.mean(losses))
+    checks.add("Bresenham (foo.py) vs sampled line choice", loss <= BRESENHAM_TOLERANCE, f"mean gain loss {loss:.2%}")
+
+    if update:
+        with open(GOLDEN_PATH, "w") as file:
+            json.dump(new_golden, file, indent=2)
+            file.write("\n")
+        print(f"Golden results written to {GOLDEN_PATH}")
+    return checks.passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deterministic regression and parity checks of the solver")
+    parser.add_argument("--update", action="store_true", help="store current pin sequences as golden results")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    passed = run(update=args.update)
+    print(f"{'passed' if passed else 'FAILED'} in {time.perf_counter() - start:.1f} s, backends: {', '.join(kernels.BACKENDS)}")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
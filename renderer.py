@@ -0,0 +1,218 @@
+import numpy as np
+import thread_profile
+import thread_calculator
+import tiled_canvas
+
+"""
+Re-rendering of thread art from a saved pin sequence, without running the solver.
+All segments are rasterized in batches with thread_calculator.line_stamps and
+their darkness is accumulated with one vectorized scatter per batch.
+"""
+
+# limits memory used by one batch of segments, every candidate pixel takes about 100 bytes in line_stamps
+_POINTS_PER_BATCH = 500_000
+
+
+def _segments(pins, pin_coords, scale):
+    pins = np.asarray(pins, dtype=int)
+    # map pixel centers of the solver image to pixel centers of the output
+    coords = (np.asarray(pin_coords, dtype=np.float32) + 0.5) * scale - 0.5
+    return coords[pins[:-1]], coords[pins[1:]]
+
+
+def _batches(starts, ends, thread_width):
+    """splits segments so one batch of line_stamps stays under _POINTS_PER_BATCH candidate pixels"""
+    lengths = np.abs(ends - starts).max(axis=1) + thread_width + 1
+    points = lengths * (2 * np.ceil(thread_width / 2 * np.sqrt(2) + 0.5) + 1)
+    batch_start = 0
+    total = 0.0
+    for i, p in enumerate(points):
+        if total + p > _POINTS_PER_BATCH and i > batch_start:
+            yield batch_start, i
+            batch_start, total = i, 0.0
+        total += p
+    if batch_start < len(points):
+        yield batch_start, len(points)
+
+
+def _accumulate(darkness, starts, ends, thread_width, profile, bounds):
+    """adds darkness of segments to darkness array (or TiledCanvas) which covers bounds"""
+    min_x, min_y, max_x, max_y = bounds
+    width = max_x - min_x
+    for begin, end in _batches(starts, ends, thread_width):
+        _, y_idx, x_idx, values = thread_calculator.line_stamps(
+            starts[begin:end], ends[begin:end], thread_width, profile, bounds)
+        if isinstance(darkness, tiled_canvas.TiledCanvas):
+            darkness.add(y_idx - min_y, x_idx - min_x, values)
+            continue
+        flat = (y_idx - min_y) * width + (x_idx - min_x)
+        np.add.at(darkness.reshape(-1), flat, values)
+
+
+def _to_brightness(darkness):
+    return (255 - np.clip(darkness, 0, 255)).astype(np.uint8)
+
+
+def render_pins(pins, pin_coords, output_size, source_size=thread_calculator.thread_calculator.IMAGE_SIZE,
+                thread_width=1.0, profile=thread_profile.trapezoidal_profile) -> np.ndarray:
+    """
+    Renders pin sequence at any resolution.
+    Args:
+        pins (_type_): sequence of pin indices, consecutive pins are connected
+        pin_coords (_type_): (num_of_pins, 2) pin coordinates in source image pixels
+        output_size (int): size of square output image
+        source_size (int): size of image pin_coords refer to
+        thread_width (float): width of thread in source image pixels
+        profile (_type_): thread profile
+    Returns:
+        np.ndarray: uint8 grayscale image, 255 is white
+    """
+    scale = output_size / source_size
+    starts, ends = _segments(pins, pin_coords, scale)
+    darkness = np.zeros((output_size, output_size), dtype=np.float32)
+    _accumulate(darkness, starts, ends, thread_width * scale, profile, (0, 0, output_size, output_size))
+    return _to_brightness(darkness)
+
+
+def render_tiles(pins, pin_coords, output_size, tile_size, source_size=thread_calculator.thread_calculator.IMAGE_SIZE,
+                 thread_width=1.0, profile=thread_profile.trapezoidal_profile):
+    """
+    Renders pin sequence tile by tile, only one tile is held in memory.
+    Yields:
+        tuple: ((left, top), uint8 tile), tiles go row by row
+    """
+    scale = output_size / source_size
+    starts, ends = _segments(pins, pin_coords, scale)
+    width = thread_width * scale
+    margin = width / 2 + 1
+    seg_min = np.minimum(starts, ends) - margin
+    seg_max = np.maximum(starts, ends) + margin
+    for top in range(0, output_size, tile_size):
+        bottom = min(top + tile_size, output_size)
+        rows = (seg_max[:, 1] >= top) & (seg_min[:, 1] < bottom)
+        for left in range(0, output_size, tile_size):
+            right = min(left + tile_size, output_size)
+            crossing = rows & (seg_max[:, 0] >= left) & (seg_min[:, 0] < right)
+            darkness = np.zeros((bottom - top, right - left), dtype=np.float32)
+            if crossing.any():
+                _accumulate(darkness, starts[crossing], ends[crossing], width, profile, (left, top, right, bottom))
+            yield (left, top), _to_brightness(darkness)
+
+
+def _clip_rows(starts, ends, top: float, bottom: float):
+    """parts of segments between rows top and bottom, segments must cross them"""
+    delta = ends - starts
+    dy = delta[:, 1]
+    vertical = dy != 0
+    safe_dy = np.where(vertical, dy, 1)
+    t0 = (top - starts[:, 1]) / safe_dy
+    t1 = (bottom - starts[:, 1]) / safe_dy
+    low = np.where(vertical, np.clip(np.minimum(t0, t1), 0, 1), 0)[:, None]
+    high = np.where(vertical, np.clip(np.maximum(t0, t1), 0, 1), 1)[:, None]
+    return starts + low * delta, starts + high * delta
+
+
+def render_bands(pins, pin_coords, output_size, band_height, source_size=thread_calculator.thread_calculator.IMAGE_SIZE,
+                 thread_width=1.0, profile=thread_profile.trapezoidal_profile):
+    """
+    Renders pin sequence band by band, only one band of full width is held in memory.
+    Segments are clipped to every band (with a margin of thread width) so long lines
+    are not rasterized again for every band they cross.
+    Yields:
+        tuple: (top, uint8 band of shape (rows, output_size))
+    """
+    scale = output_size / source_size
+    starts, ends = _segments(pins, pin_coords, scale)
+    width = thread_width * scale
+    margin = width / 2 + 1
+    seg_min = np.minimum(starts[:, 1], ends[:, 1]) - margin
+    seg_max = np.maximum(starts[:, 1], ends[:, 1]) + margin
+    for top in range(0, output_size, band_height):
+        bottom = min(top + band_height, output_size)
+        crossing = (seg_max >= top) & (seg_min < bottom)
+        darkness = np.zeros((bottom - top, output_size), dtype=np.float32)
+        if crossing.any():
+            band_starts, band_ends = _clip_rows(starts[crossing], ends[crossing], top - margin, bottom + margin)
+            _accumulate(darkness, band_starts, band_ends, width, profile, (0, top, output_size, bottom))
+        yield top, _to_brightness(darkness)
+
+
+def render_to_png(path, pins, pin_coords, output_size, tile_size=1024, memmap_path=None,
+                  source_size=thread_calculator.thread_calculator.IMAGE_SIZE, thread_width=1.0,
+                  profile=thread_profile.trapezoidal_profile):
+    """
+    Renders pin sequence and streams it to png band by band, the whole image is never held in memory.
+    Without memmap_path every band of tile_size rows is rendered and written before the next one,
+    with memmap_path threads are accumulated into a TiledCanvas backed by that file first.
+    Returns:
+        tiled_canvas.TiledCanvas backed by memmap_path or None
+    """
+    if memmap_path is None:
+        bands = render_bands(pins, pin_coords, output_size, tile_size, source_size, thread_width, profile)
+        tiled_canvas.write_png(path, output_size, output_size, (band for _, band in bands))
+        return None
+    scale = output_size / source_size
+    starts, ends = _segments(pins, pin_coords, scale)
+    canvas = tiled_canvas.TiledCanvas(output_size, output_size, tile_size, memmap_path)
+    _accumulate(canvas, starts, ends, thread_width * scale, profile, (0, 0, output_size, output_size))
+    canvas.save_png(path, _to_brightness)
+    canvas.flush()
+    return canvas
+
+
+def save_tiles(directory, pins, pin_coords, output_size, tile_size, **kwargs):
+    """saves every tile as separate png named tile_<top>_<left>.png"""
+    import os
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    for (left, top), tile in render_tiles(pins, pin_coords, output_size, tile_size, **kwargs):
+        Image.fromarray(tile).save(os.path.join(directory, f"tile_{top}_{left}.png"))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import pin_sequence
+
+    parser = argparse.ArgumentParser(description="Render thread art from saved pin sequence")
+    parser.add_argument("pins", help="pin sequence, .tpin or selected_pins.txt")
+    parser.add_argument("--num-pins", type=int, help="number of pins, required for text sequences")
+    parser.add_argument("--start-angle", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, help="seed of pin layout used when solving")
+    parser.add_argument("--layout", help="csv with pins of non circular frame, see pin_layout.load_csv")
+    parser.add_argument("--size", type=int, default=4000, help="output size in pixels")
+    parser.add_argument("--width", type=float, help="thread width in solver pixels")
+    parser.add_argument("--tile", type=int, help="render tiles of this size into --out directory")
+    parser.add_argument("--poster", action="store_true", help="stream --out png band by band")
+    parser.add_argument("--memmap", help="accumulate --poster render in a tiled canvas backed by this file")
+    parser.add_argument("--out", default="render.png")
+    args = parser.parse_args()
+
+    import pin_layout
+
+    if args.pins.endswith(".tpin"):
+        header, pins = pin_sequence.read_pins(args.pins)
+    else:
+        if args.num_pins is None:
+            parser.error("--num-pins is required for text sequences")
+        pins = pin_sequence.read_text_pins(args.pins)
+        header = pin_sequence.PinSequenceHeader(args.num_pins)
+    if args.layout:
+        coords = pin_layout.load_csv(args.layout, thread_calculator.thread_calculator.IMAGE_SIZE).coords
+    else:
+        coords = pin_layout.circle_pin_coords(header.num_of_pins, args.start_angle,
+                                              thread_calculator.thread_calculator.IMAGE_SIZE, args.seed)
+    if header.layout_hash and header.layout_hash != pin_sequence.layout_hash(coords):
+        print("Warning: pin layout does not match the one used for solving, check --layout, --start-angle and --seed")
+    width = args.width if args.width is not None else header.thread_width
+
+    start = time.time()
+    if args.poster:
+        render_to_png(args.out, pins, coords, args.size, args.tile or 1024, args.memmap, thread_width=width)
+    elif args.tile:
+        save_tiles(args.out, pins, coords, args.size, args.tile, thread_width=width)
+    else:
+        from PIL import Image
+        Image.fromarray(render_pins(pins, coords, args.size, thread_width=width)).save(args.out)
+    print(f"Rendered {len(pins) - 1} lines at {args.size}px in {time.time() - start:.2f} seconds.")
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import numpy as np
+import pin_sequence
+import thread_calculator
+
+"""
+On-disk content addressed cache of solved thread art.
+Key is a hash of everything that determines the result: prepared grayscale image,
+pin layout, thread profile and width, line limit, solver settings and ENGINE_VERSION.
+Every entry is a .tpin pin sequence and a .png rendered image,
+least recently used entries are removed when the cache grows over max_bytes.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = ".thread_cache"
+
+
+class ResultCache:
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            directory (_type_): directory of cache entries, created if missing
+            max_bytes (int): total size of entries kept on disk
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(tc, limit: int, start_pin: int = 0) -> str:
+        """
+        cache key of solving thread_calculator tc with limit lines from start_pin,
+        pins already in tc._selected_pins (continued sequence) are part of the key
+        """
+        h = hashlib.sha256()
+        h.update(thread_calculator.ENGINE_VERSION.encode())
+        h.update(np.ascontiguousarray(tc.vector).tobytes())
+        h.update(np.ascontiguousarray(tc.pin_coords, dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(tc.layout.sides, dtype=np.int64).tobytes())
+        settings = (tc._thread_profile.key(), tc._thread_width, limit,
+                    tc._ignore_close_pins, tc._max_line_reuse, tc._perceptual_sigma, start_pin)
+        h.update(repr(settings).encode())
+        h.update(np.asarray(tc._selected_pins, dtype=np.int64).tobytes())
+        if tc._importance is not None:
+            h.update(tc._importance.tobytes())
+        return h.hexdigest()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + ".tpin", base + ".png"
+
+    def get(self, key: str):
+        """
+        Returns:
+            tuple: (list of pins, PIL image) or None if key is not cached
+        """
+        from PIL import Image
+
+        pins_path, image_path = self._paths(key)
+        if not (os.path.exists(pins_path) and os.path.exists(image_path)):
+            return None
+        try:
+            _, pins = pin_sequence.read_pins(pins_path)
+            pins = [int(pin) for pin in pins]
+            image = Image.open(image_path)
+            image.load()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping broken cache entry {key}: {e}")
+            self._remove(key)
+            return None
+        # mark as recently used
+        for path in (pins_path, image_path):
+            os.utime(path)
+        return pins, image
+
+    def put(self, key: str, pins, image, header: pin_sequence.PinSequenceHeader):
+        pins_path, image_path = self._paths(key)
+        # write to temporary files first so readers never see half written entry
+        pin_sequence.write_pins(pins_path + ".tmp", pins, header)
+        image.save(image_path + ".tmp", format="PNG")
+        os.replace(image_path + ".tmp", image_path)
+        os.replace(pins_path + ".tmp", pins_path)
+        self._evict()
+
+    def _remove(self, key: str):
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _entries(self):
+        """(last use, size, key) of every entry"""
+        entries = {}
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext not in (".tpin", ".png"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            used, size = entries.get(key, (0.0, 0))
+            entries[key] = (max(used, stat.st_mtime), size + stat.st_size)
+        return [(used, size, key) for key, (used, size) in entries.items()]
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+            logger.debug(f"Evicted cache entry {key}")
+
+
+def _replay(tc, pins, limit, save_pins=False, pins_path="selected_pins.txt", progress=None, exporters=(), **kwargs):
+    """
+    draws cached pins on tc as calculate_thread would, so residual, line usage and tracked metrics
+    are the same as after solving (refine can continue from them),
+    lines of pins already in tc._selected_pins are drawn already
+    """
+    tc._close_pins_mask = tc._build_close_pins_mask()
+    drawn = len(tc._selected_pins)
+    tc._selected_pins = [int(pin) for pin in pins]
+    for exporter in exporters:
+        exporter.extend(tc._selected_pins)
+    new_pins = tc._selected_pins[drawn:]
+    for line, (pin1, pin2) in enumerate(zip(new_pins[:-1], new_pins[1:])):
+        tc._mark_line_drawn(pin1, pin2)
+        tc._line(pin1, pin2)
+        if progress is not None:
+            progress(line + 1, limit, pin2, tc._metrics and tc._metrics.summary())
+    tc._finished = True
+    if save_pins:
+        if pins_path.endswith(".tpin"):
+            pin_sequence.write_pins(pins_path, tc._selected_pins, tc.pin_sequence_header())
+        else:
+            pin_sequence.write_text_pins(pins_path, tc._selected_pins)
+
+
+def cached_calculate_thread(tc, cache, limit=2000, on_miss=None, **kwargs):
+    """
+    calculate_thread going through cache, on hit the solver is not run,
+    cached pins are drawn on tc instead (see _replay).
+    Only finished calculations are stored, not ones stopped by progress callback.
+    Args:
+        on_miss (_type_): called without arguments instead of calculate_thread when result is not cached
+            (e.g. warm start), its result is not stored
+    """
+    solve = on_miss or (lambda: tc.calculate_thread(limit=limit, **kwargs))
+    if cache is None or not getattr(tc, "cacheable", True):
+        return solve()
+    key = cache.key(tc, limit, kwargs.get("start_pin", 0))
+    cached = cache.get(key)
+    if cached is not None:
+        logger.info(f"Thread art found in cache ({key[:12]})")
+        pins, image = cached
+        _replay(tc, pins, limit, **kwargs)
+        return image
+    image = solve()
+    if on_miss is None and tc._finished:
+        cache.put(key, tc._selected_pins, image, tc.pin_sequence_header())
+    return image
@@ -1,8 +1,94 @@
+import logging
 import math
-import random
+import time
 import numpy as np
 import thread_profile
-from PIL import Image
+import pin_sequence
+import pin_layout
+import kernels
+import lowpass
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# bump when changes of the solver change its results, invalidates result_cache entries
+ENGINE_VERSION = "1"
+
+# pin layouts live in pin_layout, kept here for existing callers
+circle_pin_coords = pin_layout.circle_pin_coords
+
+
+def line_stamps(starts: np.ndarray, ends: np.ndarray, thread_width: float, profile, bounds: tuple):
+    """
+    Rasterizes many thread segments at once with a help of thread_profile.
+    Every segment is walked along its major axis and only pixels close to the line are tested,
+    so the cost is proportional to line length instead of its bounding box.
+    Args:
+        starts (np.ndarray): (n, 2) x, y of segment starts, can be floats
+        ends (np.ndarray): (n, 2) x, y of segment ends
+        thread_width (float): width of thread in pixels
+        profile (_type_): thread profile
+        bounds (tuple): (min_x, min_y, max_x, max_y) pixels outside are dropped, max is exclusive
+    Returns:
+        tuple: (segment index, y indices, x indices, darkness applied to each pixel)
+    """
+    starts = np.asarray(starts, dtype=np.float32).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float32).reshape(-1, 2)
+    max_distance = thread_width / 2.0
+    reach = math.ceil(max_distance)
+    # pixels within max_distance are at most max_distance*sqrt(2) away from line along minor axis
+    minor_reach = math.ceil(max_distance * math.sqrt(2) + 0.5)
+
+    delta = ends - starts
+    horizontal = np.abs(delta[:, 0]) >= np.abs(delta[:, 1])
+    major = np.where(horizontal, 0, 1)
+    minor = 1 - major
+    seg_idx = np.arange(len(starts))
+    u0, u1 = starts[seg_idx, major], ends[seg_idx, major]
+    v0, v1 = starts[seg_idx, minor], ends[seg_idx, minor]
+    u_min = np.floor(np.minimum(u0, u1)).astype(int) - reach
+    u_max = np.ceil(np.maximum(u0, u1)).astype(int) + reach
+    counts = u_max - u_min + 1
+
+    seg = np.repeat(seg_idx, counts)
+    u = (np.arange(seg.size) - np.repeat(np.cumsum(counts) - counts, counts) + u_min[seg]).astype(np.float32)
+    du = (u1 - u0)[seg]
+    slope = np.divide((v1 - v0)[seg], du, out=np.zeros_like(du), where=du != 0)
+    u_on_segment = np.clip(u, np.minimum(u0, u1)[seg], np.maximum(u0, u1)[seg])
+    v_center = np.round(v0[seg] + (u_on_segment - u0[seg]) * slope)
+
+    offsets = np.arange(-minor_reach, minor_reach + 1, dtype=np.float32)
+    seg = np.repeat(seg, offsets.size)
+    u = np.repeat(u, offsets.size)
+    v = (v_center[:, None] + offsets[None, :]).ravel()
+    horizontal = horizontal[seg]
+    px = np.where(horizontal, u, v)
+    py = np.where(horizontal, v, u)
+
+    min_x, min_y, max_x, max_y = bounds
+    inside = (px >= min_x) & (px < max_x) & (py >= min_y) & (py < max_y)
+    seg, px, py = seg[inside], px[inside], py[inside]
+
+    # distance to segment
+    ax, ay = starts[seg, 0], starts[seg, 1]
+    line_vec = delta[seg]
+    line_length = np.hypot(line_vec[:, 0], line_vec[:, 1])
+    safe_length = np.where(line_length == 0, 1, line_length)
+    t = np.clip(((px - ax) * line_vec[:, 0] + (py - ay) * line_vec[:, 1]) / safe_length, 0, line_length)
+    closest_x = ax + t * line_vec[:, 0] / safe_length
+    closest_y = ay + t * line_vec[:, 1] / safe_length
+    distances = np.hypot(px - closest_x, py - closest_y)
+
+    within_distance_mask = distances <= max_distance
+    seg, px, py, distances = seg[within_distance_mask], px[within_distance_mask], py[within_distance_mask], distances[within_distance_mask]
+    if seg.size == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, empty, np.zeros(0, dtype=np.float32)
+
+    profile = thread_profile.as_profile(profile)
+    densities = np.clip(profile(distances / max_distance), 0.0, profile.max_density)
+    applied_darkness_values = (densities * 255).astype(np.float32)
+    return seg, py.astype(int), px.astype(int), applied_darkness_values
 
 
 class thread_calculator:
@@ -10,174 +96,560 @@ class thread_calculator:
     Class for calculating thread vector from image
     """
     IMAGE_SIZE=1000
-    def __init__(self,image,start_angle, num_of_pins,profile=thread_profile.trapezoidal_profile):
+    # memory of cached chord stamps, least recently used ones are dropped above it
+    STAMP_CACHE_BYTES=256*1024*1024
+    def __init__(self,image,start_angle, num_of_pins,profile=thread_profile.trapezoidal_profile,seed=None,layout=None):
         """
         Args:
             image (_type_): image to calculate threads, image need to be of size 1000x1000
             start_angle (_type_): angle of first pin
-            num_of_pins (_type_): number of pins
+            num_of_pins (_type_): number of pins, can be None when layout is given
             profile (_type_): profile of thread, default is trapezoidal
+            seed (_type_): seed of pin position noise, same seed gives the same pin layout
+            layout (_type_): pin_layout.PinLayout of non circular frame, default is circle inscribed in the image
         """
         if image.width != self.IMAGE_SIZE or image.height != self.IMAGE_SIZE:
             raise ValueError("Image size must be 1000x1000")
         self.image=image.convert("L")
         # TODO use numpy
         self.vector=255-np.array(self.image,dtype=np.uint8)
-        self.output_vector = np.full((self.IMAGE_SIZE,self.IMAGE_SIZE),255,dtype=np.uint8)
+        if layout is None:
+            layout = pin_layout.circle(num_of_pins, start_angle, self.IMAGE_SIZE, seed)
+        elif num_of_pins is not None and num_of_pins != len(layout.coords):
+            raise ValueError(f"Layout has {len(layout.coords)} pins, not {num_of_pins}")
+        self.layout=layout
+        num_of_pins=len(layout.coords)
+        # signed residual: target darkness minus darkness already applied by threads
+        self._residual = self.vector.astype(np.float32)
+        # optional per pixel weight used when scoring lines, see set_importance_map
+        self._importance = None
+        # blurred residual lines are scored on in perceptual mode, see set_perceptual_scoring
+        self._perceptual_sigma = None
+        self._blurred_residual = None
         self.num_of_pins=num_of_pins
-        self._thread_profile=profile
+        # pixels of chords already rasterized, keyed by (pin1, pin2), cleared when thread width or profile change,
+        # bounded by STAMP_CACHE_BYTES
+        self._stamp_cache={}
+        self._stamp_cache_bytes=0
+        self._thread_profile=thread_profile.as_profile(profile)
         self._thread_width=1
         self._ignore_close_pins=10
-        self._drawn_lines=set()
+        # how many times the same chord may be drawn
+        self._max_line_reuse=1
+        # symmetric matrix counting how many times each chord was drawn
+        self._line_usage=np.zeros((self.num_of_pins,self.num_of_pins),dtype=np.uint8)
+        self._close_pins_mask=None
         self._selected_pins=[]
+        # whether the last calculate_thread reached its limit or ran out of lines
+        self._finished=False
+        # quality metrics updated with every drawn line, see track_metrics
+        self._metrics=None
 
         # pin coords
-        self.pin_coords = np.zeros((self.num_of_pins, 2), dtype=int)
-        center_x = center_y = radius = self.IMAGE_SIZE / 2
-        for i in range(self.num_of_pins):
-            angle = start_angle + i * 2 * np.pi / self.num_of_pins
-            x = int(center_x + radius * np.cos(angle))
-            y = int(center_y + radius * np.sin(angle))
-            # adding noise to minimize Moire effect
-            rand=int(self.IMAGE_SIZE*0.008)
-            if x > rand:
-                x -= random.randint(1, rand)
-            elif x < (2 * radius - rand):
-                x += random.randint(1, rand)
-            if y > rand:
-                y -= random.randint(1, rand)
-            elif y < (2 * radius - rand):
-                y += random.randint(1, rand)
-            self.pin_coords[i] = (x, y)
+        self.seed=seed
+        self.start_angle=start_angle
+        self.pin_coords = layout.coords
+
+    @property
+    def _thread_width(self):
+        return self._width
+
+    @_thread_width.setter
+    def _thread_width(self, width):
+        # callers set width after __init__, cached stamps of the old width would be used otherwise
+        if getattr(self, "_width", None) != width:
+            self._clear_stamp_cache()
+        self._width = width
+
+    @property
+    def _thread_profile(self):
+        return self._profile
+
+    @_thread_profile.setter
+    def _thread_profile(self, profile):
+        profile = thread_profile.as_profile(profile)
+        if getattr(self, "_profile", None) is not profile:
+            self._clear_stamp_cache()
+        self._profile = profile
+
+    def _clear_stamp_cache(self):
+        self._stamp_cache.clear()
+        self._stamp_cache_bytes=0
+
+    def _build_close_pins_mask(self):
+        """
+        mask of chords between pins that are too close to each other along the frame
+        or lie on the same side of it, see pin_layout.close_pins_mask
+        """
+        return pin_layout.close_pins_mask(self.layout.sides, self._ignore_close_pins)
+
+    def _mark_line_drawn(self, pin1_idx: int, pin2_idx: int):
+        self._line_usage[pin1_idx, pin2_idx] += 1
+        if pin1_idx != pin2_idx:
+            self._line_usage[pin2_idx, pin1_idx] += 1
 
+    def _unmark_line_drawn(self, pin1_idx: int, pin2_idx: int):
+        self._line_usage[pin1_idx, pin2_idx] -= 1
+        if pin1_idx != pin2_idx:
+            self._line_usage[pin2_idx, pin1_idx] -= 1
+
+    def _line_allowed(self, pin1_idx: int, pin2_idx: int) -> bool:
+        return not self._close_pins_mask[pin1_idx, pin2_idx] and self._line_usage[pin1_idx, pin2_idx] < self._max_line_reuse
+
+    def _candidate_pins(self, current_pin_idx: int) -> np.ndarray:
+        """indices of pins that can be connected with current_pin_idx"""
+        if self._close_pins_mask is None:
+            self._close_pins_mask = self._build_close_pins_mask()
+        allowed = ~self._close_pins_mask[current_pin_idx]
+        allowed &= self._line_usage[current_pin_idx] < self._max_line_reuse
+        # search order starts at current pin and goes around the frame
+        order = (current_pin_idx + np.arange(self.num_of_pins)) % self.num_of_pins
+        return order[allowed[order]]
+
+    def set_importance_map(self, weights):
+        """
+        Sets precomputed weight of every pixel used when scoring lines (e.g. importance.edge_map).
+        Args:
+            weights (_type_): float array of size IMAGE_SIZE x IMAGE_SIZE or None to disable weighting
+        """
+        if weights is None:
+            self._importance = None
+            return
+        weights = np.asarray(weights, dtype=np.float32)
+        if weights.shape != self._residual.shape:
+            raise ValueError(f"Importance map must be of shape {self._residual.shape}")
+        self._importance = weights
+
+    def set_perceptual_scoring(self, sigma=lowpass.PERCEPTUAL_SIGMA):
+        """
+        Scores lines by error of blurred image against blurred target instead of per pixel error,
+        thread art is seen from a distance so solver should not over-darken thin strips.
+        Blurred residual is kept up to date by subtracting blurred stamp of every drawn line.
+        refine and warm start still accept changes by per pixel error.
+        Args:
+            sigma (_type_): sigma of blur in pixels or None to score per pixel again
+        """
+        if sigma is None:
+            self._perceptual_sigma = None
+            self._blurred_residual = None
+            return
+        # gain of a line is <B(r), B(stamp)> = <B(B(r)), stamp>, blurring twice with sigma
+        # is blurring once with sigma*sqrt(2) so lines are scored by sampling that along them
+        self._perceptual_sigma = sigma
+        self._blurred_residual = lowpass.blur(self._residual, sigma * math.sqrt(2))
+
+    def track_metrics(self, sigma=lowpass.PERCEPTUAL_SIGMA, bins=16):
+        """
+        Starts keeping quality metrics (metrics.IncrementalMetrics) up to date while lines are drawn,
+        they are passed to progress callback of calculate_thread.
+        """
+        self._metrics = metrics.IncrementalMetrics(self.vector, self._residual, sigma, bins)
+        return self._metrics
+
+    @property
+    def output_vector(self):
+        """brightness of drawn threads, derived from the residual"""
+        achieved_darkness = self.vector - self._residual
+        return (255 - np.clip(achieved_darkness, 0, 255)).astype(np.uint8)
+
+    def pin_sequence_header(self):
+        """header describing this layout for pin_sequence files"""
+        return pin_sequence.PinSequenceHeader(
+            self.num_of_pins,
+            pin_sequence.layout_hash(self.pin_coords),
+            pin_sequence.profile_name(self._thread_profile),
+            self._thread_width,
+        )
 
     @staticmethod
     def _create_image_from_vector(vector):
+        # PIL is imported lazily so the engine can be imported without it
+        from PIL import Image
         return Image.fromarray(vector,mode="L")
     
-    def calculate_thread(self,draw=False,limit=2000,save_pins=False):
-        """main function for calculating threads"""
-        current_pin=0
-        # self._line(5,19)
-        for w in range(limit):
-            new_line=self._find_next_pin(current_pin)
-            self._selected_pins.append(current_pin)
-            if new_line is None:
-                print("end")
-                break
-            self._drawn_lines.add(tuple(sorted(new_line)))
-            self._line(*new_line)
-            if draw and not w%40:
-                image_from_vector = thread_calculator._create_image_from_vector(self.output_vector)
-                image_from_vector.save("output.png")
-            current_pin=new_line[1]
+    def calculate_thread(self,draw=False,limit=2000,save_pins=False,pins_path="selected_pins.txt",start_pin=0,progress=None,exporters=()):
+        """
+        main function for calculating threads
+        Args:
+            save_pins (bool): save selected pins to pins_path,
+                paths ending with .tpin are streamed in binary pin_sequence format while solving
+            start_pin (int): pin the thread continues from, pins already in self._selected_pins are kept
+            progress (_type_): called as progress(line, limit, pin, metrics) after every drawn line,
+                metrics is summary of tracked metrics or None (see track_metrics),
+                returning False stops the calculation
+            exporters (_type_): open exporters.StreamingExporter objects (or pin_sequence writers),
+                every pin is appended to them as soon as it is selected, caller closes them
+        """
+        current_pin=start_pin
+        # mask depends on _ignore_close_pins which can be changed after __init__
+        self._close_pins_mask = self._build_close_pins_mask()
+        binary_writer = None
+        if save_pins and pins_path.endswith(".tpin"):
+            binary_writer = pin_sequence.PinSequenceWriter(pins_path, self.pin_sequence_header())
+        writers = ([binary_writer] if binary_writer else []) + list(exporters)
+        # stays False when progress callback stops the calculation or it fails, see result_cache
+        self._finished = False
+        try:
+            for writer in writers:
+                writer.extend(self._selected_pins)
+            no_more_lines = False
+            for w in range(limit):
+                new_line=self._find_next_pin(current_pin)
+                self._selected_pins.append(current_pin)
+                for writer in writers:
+                    writer.append(current_pin)
+                if new_line is None:
+                    print("end")
+                    no_more_lines = True
+                    self._finished = True
+                    break
+                self._mark_line_drawn(*new_line)
+                self._line(*new_line)
+                if draw and not w%40:
+                    image_from_vector = thread_calculator._create_image_from_vector(self.output_vector)
+                    image_from_vector.save("output.png")
+                current_pin=new_line[1]
+                if progress is not None and progress(w + 1, limit, current_pin, self._metrics and self._metrics.summary()) is False:
+                    print("stopped")
+                    break
+            else:
+                # limit reached
+                self._finished = True
+            if not no_more_lines:
+                # last line ends at current_pin
+                self._selected_pins.append(current_pin)
+                for writer in writers:
+                    writer.append(current_pin)
+        finally:
+            # pins selected before an error are written out, caller closes exporters
+            for writer in writers:
+                if writer is binary_writer:
+                    writer.close()
+                else:
+                    writer.flush()
+        if save_pins and not binary_writer:
+            pin_sequence.write_text_pins(pins_path, self._selected_pins)
+
+        return self._create_image_from_vector(self.output_vector)
+
+    def calculate_threads(self,num_paths=2,schedule="round_robin",draw=False,limit=2000,save_pins=False):
+        """
+        Calculates several separate thread paths sharing one residual.
+        Args:
+            num_paths (int): number of separate threads, paths start at evenly spread pins
+            schedule (str): "round_robin" - every path draws one line per round,
+                "best_gain" - only the path with the best line draws
+            limit (int): total number of lines of all paths
+        Pin sequence of every path is stored in self._selected_paths
+        """
+        if schedule not in ("round_robin", "best_gain"):
+            raise ValueError("schedule must be 'round_robin' or 'best_gain'")
+        self._close_pins_mask = self._build_close_pins_mask()
+        heads = [i * self.num_of_pins // num_paths for i in range(num_paths)]
+        self._selected_paths = [[pin] for pin in heads]
+        active = list(range(num_paths))
+        drawn = 0
+        while drawn < limit and active:
+            new_lines, gains = self._find_next_pins([heads[path] for path in active])
+            if schedule == "best_gain":
+                best = int(np.argmax(gains))
+                order = [best] if new_lines[best] else []
+            else:
+                order = range(len(active))
+            finished = [active[i] for i, line in enumerate(new_lines) if line is None]
+            for i in order:
+                path, new_line = active[i], new_lines[i]
+                if new_line is None or drawn >= limit:
+                    continue
+                # other head could take the same chord in this round
+                if self._line_usage[new_line] >= self._max_line_reuse:
+                    continue
+                self._mark_line_drawn(*new_line)
+                self._line(*new_line)
+                heads[path] = new_line[1]
+                self._selected_paths[path].append(new_line[1])
+                drawn += 1
+                if draw and not drawn%40:
+                    image_from_vector = thread_calculator._create_image_from_vector(self.output_vector)
+                    image_from_vector.save("output.png")
+            if schedule == "best_gain" and not order:
+                finished = active
+            active = [path for path in active if path not in finished]
+        if not active:
+            print("end")
         if save_pins:
-            with open("selected_pins.txt", "w") as file:
-                for i,pin in enumerate(self._selected_pins):
-                    file.write(f"{i}.\t{pin}\n")
+            for path, pins in enumerate(self._selected_paths):
+                pin_sequence.write_text_pins(f"selected_pins_{path}.txt", pins)
 
         return self._create_image_from_vector(self.output_vector)
 
-    def _line(self, pin1_idx: int, pin2_idx: int):
+    @staticmethod
+    def remap_pins(pins, old_num_of_pins: int, old_start_angle: float, new_num_of_pins: int, new_start_angle: float) -> list:
         """
-        drawing lines with a help of thread_profile which determine how thread apply color
-        especially needed for bigger resolutions
+        Moves every pin of a sequence to the nearest pin (by angle) of another circle layout,
+        repeated pins created by the mapping are dropped.
         """
-        x1, y1 = self.pin_coords[pin1_idx]
-        x2, y2 = self.pin_coords[pin2_idx]
-        max_distance = self._thread_width / 2.0
+        remapped = []
+        for pin in pins:
+            angle = old_start_angle + int(pin) * 2 * np.pi / old_num_of_pins
+            new_pin = int(round((angle - new_start_angle) * new_num_of_pins / (2 * np.pi))) % new_num_of_pins
+            if not remapped or remapped[-1] != new_pin:
+                remapped.append(new_pin)
+        return remapped
 
-        line_vec = np.array([x2 - x1, y2 - y1], dtype=np.float32)
-        line_length_sq = np.sum(line_vec**2)
+    def warm_start(self,previous_pins,previous_num_of_pins=None,previous_start_angle=None,repair_lines=200,draw=False,save_pins=False,pins_path="selected_pins.txt",previous_pin_coords=None,exporters=(),limit=2000):
+        """
+        Calculates threads starting from a previous solution instead of from nothing,
+        used when framing or number of pins changed only slightly.
+        Previous sequence is remapped to this layout and drawn, then pins whose removal lowers
+        the error are removed and at most repair_lines new lines are added greedily,
+        the result never has more than limit lines.
+        Args:
+            previous_pins (_type_): pin sequence of previous solution
+            previous_num_of_pins (_type_): number of pins of previous layout, default same as this one
+            previous_start_angle (_type_): start angle of previous layout, default same as this one
+            repair_lines (int): number of lines added after replaying
+            previous_pin_coords (_type_): pin coordinates of previous layout, pins are then moved
+                to the nearest pins instead of by angle (for non circular layouts)
+            limit (int): total number of lines, longer previous sequence is cut
+        """
+        if previous_num_of_pins is None:
+            previous_num_of_pins = self.num_of_pins
+        if previous_start_angle is None:
+            previous_start_angle = self.start_angle
+        self._close_pins_mask = self._build_close_pins_mask()
+        if previous_pin_coords is not None:
+            pins = pin_layout.nearest_pins(previous_pins, previous_pin_coords, self.pin_coords)
+        else:
+            pins = self.remap_pins(previous_pins, previous_num_of_pins, previous_start_angle, self.num_of_pins, self.start_angle)
 
-        # Bounding box
-        min_x = max(0, int(min(x1, x2) - math.ceil(max_distance)))
-        max_x = min(self.IMAGE_SIZE, int(max(x1, x2) + math.ceil(max_distance) + 1))
-        min_y = max(0, int(min(y1, y2) - math.ceil(max_distance)))
-        max_y = min(self.IMAGE_SIZE, int(max(y1, y2) + math.ceil(max_distance) + 1))
+        # replay, pins which would make forbidden line are skipped
+        path = pins[:1]
+        for pin in pins[1:]:
+            if len(path) > limit:
+                break
+            if self._line_allowed(path[-1], pin):
+                self._mark_line_drawn(path[-1], pin)
+                self._line(path[-1], pin)
+                path.append(pin)
 
-        x_coords_grid, y_coords_grid = np.meshgrid(np.arange(min_x, max_x), np.arange(min_y, max_y))
-        P_coords = np.stack((x_coords_grid.flatten(), y_coords_grid.flatten()), axis=1).astype(np.float32)
+        i = 1
+        while i < len(path) - 1:
+            if not self._try_remove_pin(path, i):
+                i += 1
 
-        if line_length_sq == 0:
-            distances = np.linalg.norm(P_coords - np.array([x1, y1], dtype=np.float32), axis=1)
-        else:
-            line_length = np.sqrt(line_length_sq)
-            line_vec_normalized = line_vec / line_length
-            AP = P_coords - np.array([x1, y1], dtype=np.float32)
-            t = np.dot(AP, line_vec_normalized)
-            
-            t_clamped = np.clip(t, 0, line_length)
-            
-            closest_points_on_segment = np.array([x1, y1], dtype=np.float32) + np.outer(t_clamped, line_vec_normalized)
-            distances = np.linalg.norm(P_coords - closest_points_on_segment, axis=1)
-
-        within_distance_mask = distances <= max_distance
-        
-        relevant_P_coords = P_coords[within_distance_mask]
-        relevant_distances = distances[within_distance_mask]
-
-        if relevant_P_coords.size == 0:
-            return
+        self._selected_pins = path[:-1]
+        repair_lines = max(0, min(repair_lines, limit - (len(path) - 1)))
+        return self.calculate_thread(draw=draw,limit=repair_lines,save_pins=save_pins,pins_path=pins_path,start_pin=path[-1] if path else 0,exporters=exporters)
 
-        x_for_profile_0_1 = relevant_distances / max_distance
+    def refine(self, time_budget=10.0, draw=False):
+        """
+        Local search after greedy solving, tries removing pins from self._selected_pins
+        and moving them to other pins, every change which lowers squared residual error is kept.
+        Every trial touches only pixels of a few chords.
+        Args:
+            time_budget (float): seconds to spend
+        Returns:
+            image after refinement
+        """
+        deadline = time.monotonic() + time_budget
+        self._close_pins_mask = self._build_close_pins_mask()
+        path = self._selected_pins
+        lines_before = len(path) - 1
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            i = 1
+            while i < len(path) - 1 and time.monotonic() < deadline:
+                if self._try_remove_pin(path, i) or self._try_move_pin(path, i):
+                    improved = True
+                    continue
+                i += 1
+        logger.info(f"refine: {lines_before} -> {len(path) - 1} lines")
+        if draw:
+            self._create_image_from_vector(self.output_vector).save("output.png")
+        return self._create_image_from_vector(self.output_vector)
+
+    def _try_move_pin(self, path: list, i: int) -> bool:
+        """moves path[i] to the pin which best connects its neighbours if it lowers the error"""
+        prev_pin, pin, next_pin = path[i - 1], path[i], path[i + 1]
+        if prev_pin == next_pin:
+            return False
+        removed = [(prev_pin, pin), (pin, next_pin)]
+        # score replacements as if current chords were not drawn
+        self._apply_chords(removed, -1.0)
+        for chord in removed:
+            self._unmark_line_drawn(*chord)
+        allowed = ~self._close_pins_mask[prev_pin] & ~self._close_pins_mask[next_pin]
+        allowed &= self._line_usage[prev_pin] < self._max_line_reuse
+        allowed &= self._line_usage[next_pin] < self._max_line_reuse
+        allowed[pin] = False
+        candidates = np.flatnonzero(allowed)
+        if candidates.size:
+            gains = (self._calculate_efficiencies(np.full(candidates.size, prev_pin), candidates)
+                     + self._calculate_efficiencies(candidates, np.full(candidates.size, next_pin)))
+        self._apply_chords(removed)
+        for chord in removed:
+            self._mark_line_drawn(*chord)
+        if not candidates.size:
+            return False
+        new_pin = int(candidates[np.argmax(gains)])
+        if not self._try_replace(removed, [(prev_pin, new_pin), (new_pin, next_pin)]):
+            return False
+        path[i] = new_pin
+        return True
+
+    def _apply_chords(self, chords, sign=1.0):
+        """draws (sign=1) or erases (sign=-1) chords"""
+        for pin1_idx, pin2_idx in chords:
+            y_idx, x_idx, darkness = self._line_stamp(pin1_idx, pin2_idx)
+            self._subtract_stamp(y_idx, x_idx, sign * darkness)
 
-        vectorized_profile_func = np.vectorize(self._thread_profile)
-        densities = vectorized_profile_func(x_for_profile_0_1)
-        
-        densities = np.clip(densities, 0.0, thread_profile._MAX_DENSITY)
-        
-        applied_darkness_values = (densities * 255).astype(np.float32)
+    def _chords_error(self, chords) -> float:
+        """squared residual error over pixels of chords"""
+        stamps = [self._line_stamp(*chord) for chord in chords]
+        y_idx = np.concatenate([stamp[0] for stamp in stamps])
+        x_idx = np.concatenate([stamp[1] for stamp in stamps])
+        flat = np.unique(y_idx.astype(int) * self.IMAGE_SIZE + x_idx)
+        values = self._residual.reshape(-1)[flat]
+        if self._importance is not None:
+            return float(np.sum(values**2 * self._importance.reshape(-1)[flat]))
+        return float(np.sum(values**2))
 
-        pixel_y_indices = relevant_P_coords[:, 1].astype(int)
-        pixel_x_indices = relevant_P_coords[:, 0].astype(int)
+    def _try_replace(self, removed, added) -> bool:
+        """
+        replaces drawn chords with new ones if it lowers squared residual error,
+        otherwise leaves everything as it was
+        """
+        error_before = self._chords_error(removed + added)
+        self._apply_chords(removed, -1.0)
+        self._apply_chords(added)
+        if self._chords_error(removed + added) < error_before:
+            for chord in removed:
+                self._unmark_line_drawn(*chord)
+            for chord in added:
+                self._mark_line_drawn(*chord)
+            return True
+        self._apply_chords(added, -1.0)
+        self._apply_chords(removed)
+        return False
 
-        current_pixel_values = self.output_vector[pixel_y_indices, pixel_x_indices].astype(np.float32)
-        updated_values = np.clip(current_pixel_values - applied_darkness_values, 0, 255).astype(np.uint8)
-        self.output_vector[pixel_y_indices, pixel_x_indices] = updated_values
+    def _try_remove_pin(self, path: list, i: int) -> bool:
+        """removes path[i] joining its neighbours directly if it lowers the error"""
+        prev_pin, pin, next_pin = path[i - 1], path[i], path[i + 1]
+        removed = [(prev_pin, pin), (pin, next_pin)]
+        added = []
+        if prev_pin != next_pin:
+            if not self._line_allowed(prev_pin, next_pin):
+                return False
+            added = [(prev_pin, next_pin)]
+        if not self._try_replace(removed, added):
+            return False
+        del path[i]
+        if prev_pin == next_pin:
+            # path went there and back, drop the duplicate as well
+            del path[i]
+        return True
+
+    def _line(self, pin1_idx: int, pin2_idx: int):
+        """draws line by removing its darkness from the residual in place"""
+        y_idx, x_idx, darkness = self._line_stamp(pin1_idx, pin2_idx)
+        self._subtract_stamp(y_idx, x_idx, darkness)
+
+    def _subtract_stamp(self, y_idx, x_idx, darkness):
+        """
+        removes darkness of stamp from the residual,
+        blurred residual and tracked metrics are updated from its pixels
+        """
+        residual_before = self._residual[y_idx, x_idx] if self._metrics is not None else None
+        kernels.subtract_stamp(self._residual, y_idx, x_idx, darkness)
+        if self._blurred_residual is not None:
+            for rows, cols, patch in lowpass.blurred_stamp_patches(y_idx, x_idx, darkness, self._residual.shape,
+                                                                   self._perceptual_sigma * math.sqrt(2)):
+                self._blurred_residual[rows, cols] -= patch
+        if self._metrics is not None:
+            self._metrics.update(y_idx, x_idx, residual_before, self._residual[y_idx, x_idx])
+
+    def _line_stamp(self, pin1_idx: int, pin2_idx: int):
+        """
+        pixels of a line with a help of thread_profile which determine how thread apply color
+        especially needed for bigger resolutions
+        Returns:
+            tuple: (y indices, x indices, darkness applied to each pixel)
+        """
+        key = (pin1_idx, pin2_idx)
+        stamp = self._stamp_cache.pop(key, None)
+        if stamp is None:
+            _, y_idx, x_idx, darkness = line_stamps(
+                self.pin_coords[[pin1_idx]], self.pin_coords[[pin2_idx]],
+                self._thread_width, self._thread_profile, (0, 0, self.IMAGE_SIZE, self.IMAGE_SIZE))
+            stamp = (y_idx.astype(np.int16), x_idx.astype(np.int16), darkness)
+            self._stamp_cache_bytes += sum(array.nbytes for array in stamp)
+            # dict keeps insertion order, the first entries are the least recently used
+            while self._stamp_cache and self._stamp_cache_bytes > self.STAMP_CACHE_BYTES:
+                oldest = self._stamp_cache.pop(next(iter(self._stamp_cache)))
+                self._stamp_cache_bytes -= sum(array.nbytes for array in oldest)
+        self._stamp_cache[key] = stamp
+        return stamp
 
     def _calculate_efficiency(self, pin1_idx: int, pin2_idx: int) -> float:
         """
         Calculates the efficiency of a line between two pins.
-        A higher value indicates a better line (removes more "darkness" from the target image).
-        """
-        # TODO FEATURE: giving bigger score for threads that create edges
-        x0, y0 = self.pin_coords[pin1_idx]
-        x1, y1 = self.pin_coords[pin2_idx]
-        length = int(np.hypot(x1 - x0, y1 - y0))
-        # mask of line
-        x = np.linspace(x0, x1, length).astype(np.int16)
-        y = np.linspace(y0, y1, length).astype(np.int16)
-        
-        target=self.vector[y,x]
-        current_color=self.output_vector[y,x]
-        actual_added=np.minimum(current_color,255*thread_profile._MAX_DENSITY)
-        return np.sum(actual_added*target)
+        A higher value indicates a better line (covers more of the darkness still missing),
+        lines going through already too dark pixels get negative score.
+        """
+        # line is sampled with int(length) points like np.linspace(start, end, length)
+        return float(self._calculate_efficiencies(np.array([pin1_idx]), np.array([pin2_idx]))[0])
+
+    def _chord_samples(self, pins1: np.ndarray, pins2: np.ndarray):
+        """
+        Samples many chords at once, same points as _calculate_efficiency uses for a single chord.
+        Returns:
+            tuple: (chord index of every sample, y indices, x indices)
+        """
+        return kernels.chord_samples(self.pin_coords[pins1], self.pin_coords[pins2])
+
+    def _calculate_efficiencies(self, pins1: np.ndarray, pins2: np.ndarray) -> np.ndarray:
+        """
+        Vectorized _calculate_efficiency for many chords in one call.
+        """
+        residual = self._residual if self._blurred_residual is None else self._blurred_residual
+        return kernels.score_chords(residual, self._importance, self.pin_coords[pins1], self.pin_coords[pins2])
+
+    def _find_next_pins(self, head_pins: list) -> list:
+        """
+        Finds the best line for every path head, all heads are scored in one batched call.
+        Returns:
+            tuple: list with (head_pin_idx, best_next_pin_idx) or None for every head, list of their efficiencies
+        """
+        candidates = [self._candidate_pins(pin) for pin in head_pins]
+        sizes = [c.size for c in candidates]
+        pins1 = np.repeat(np.asarray(head_pins, dtype=int), sizes)
+        pins2 = np.concatenate(candidates) if candidates else np.zeros(0, dtype=int)
+        efficiencies = self._calculate_efficiencies(pins1, pins2)
+
+        lines, gains = [], []
+        for pin, head_candidates, head_efficiencies in zip(head_pins, candidates, np.split(efficiencies, np.cumsum(sizes)[:-1])):
+            best = int(np.argmax(head_efficiencies)) if head_candidates.size else -1
+            if best == -1 or head_efficiencies[best] <= 0:
+                lines.append(None)
+                gains.append(0.0)
+            else:
+                lines.append((pin, int(head_candidates[best])))
+                gains.append(float(head_efficiencies[best]))
+        return lines, gains
 
     def _find_next_pin(self, current_pin_idx: int) -> tuple | None:
         """
         Finds the best line from current_pin_idx to another pin based on efficiency.
         Returns a tuple (current_pin_idx, best_next_pin_idx) or None if no effective line is found.
         """
-        best_efficiency = -1.0
-        best_next_pin_idx = -1
-
-        
-        for i in range(self.num_of_pins-1):
-            searched_pin_idx=(current_pin_idx+i) % self.num_of_pins
-            if tuple(sorted((searched_pin_idx,current_pin_idx))) in self._drawn_lines:
-                continue
-            if abs(current_pin_idx-searched_pin_idx)<self._ignore_close_pins:
-                continue
-            efficiency = self._calculate_efficiency(current_pin_idx, searched_pin_idx)
-
-            if efficiency > best_efficiency:
-                best_efficiency,best_next_pin_idx = efficiency,searched_pin_idx
-        
-        return (current_pin_idx, best_next_pin_idx)
+        lines, _ = self._find_next_pins([current_pin_idx])
+        return lines[0]
 
 if __name__ == "__main__":
     import sys
+    from PIL import Image
     from matplotlib import pyplot as plt
     
     image_path = sys.argv[1]
@@ -189,9 +661,18 @@ if __name__ == "__main__":
         image = image.resize((size,size), resample=Image.BICUBIC)
 
     
-    tc=thread_calculator(image,0, 200)
+    tc=thread_calculator(image,0, 200, seed=0)
     tc._thread_width=1
-    calculated_image=tc.calculate_thread(draw=True,limit=4000)
+    if "--edges" in sys.argv:
+        import importance
+        tc.set_importance_map(importance.edge_map(image, strength=2.0))
+    if "--perceptual" in sys.argv:
+        tc.set_perceptual_scoring()
+    import result_cache
+    cache = None if "--no-cache" in sys.argv else result_cache.ResultCache()
+    calculated_image=result_cache.cached_calculate_thread(tc,cache,draw=True,limit=4000)
+    if "--refine" in sys.argv:
+        calculated_image=tc.refine(time_budget=60)
     plt.imshow(calculated_image,cmap='gray')
     plt.show()
     calculated_image.save("output.png")
\ No newline at end of file
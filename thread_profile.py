@@ -1,78 +1,236 @@
-import math
+import hashlib
+import numpy as np
 
 """
 Thread profiles
-defined as functions that take a normalized x value (-1.0 to 1.0) and return a density value (0.0 to 1.0).
+defined as objects that take a normalized x value (-1.0 to 1.0), scalar or numpy array,
+and return a density value (0.0 to max_density).
+Parameters are validated once when the profile is created.
 """
 
 _MAX_DENSITY = 0.2
-def rectangular_profile(x: float) -> float:
+
+
+class ThreadProfile:
+    """
+    Base of thread profiles, subclasses define _shape on |x| in [0, 1] returning values in [0, 1].
+    """
+    kind = "profile"
+
+    def __init__(self, max_density: float = _MAX_DENSITY):
+        if not (0.0 <= max_density <= 1.0):
+            raise ValueError("max_density must be in the range [0, 1].")
+        self.max_density = max_density
+
+    def _shape(self, abs_x: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _parameters(self) -> dict:
+        """parameters which determine densities, part of name and key"""
+        return {"max_density": self.max_density}
+
+    @property
+    def name(self) -> str:
+        """short name with parameters, e.g. trapezoidal_profile(0.5,0.2)"""
+        return f"{self.kind}({','.join(f'{value:g}' for value in self._parameters().values())})"
+
+    def key(self) -> str:
+        """full description with exact parameters, profiles with the same key give the same densities"""
+        return repr(self)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        abs_x = np.abs(x)
+        inside = abs_x <= 1.0
+        density = np.where(inside, self.max_density * self._shape(np.where(inside, abs_x, 0.0)), 0.0)
+        if density.ndim == 0:
+            return float(density)
+        return density
+
+    def scaled(self, factor: float) -> "ThreadProfile":
+        """same shape with max_density multiplied by factor"""
+        return ScaledProfile(self, factor)
+
+    def with_max_density(self, max_density: float) -> "ThreadProfile":
+        """same shape with different max_density"""
+        return ScaledProfile(self, max_density / self.max_density if self.max_density else 0.0)
+
+    def __add__(self, other: "ThreadProfile") -> "ThreadProfile":
+        """profile of two threads laid over each other"""
+        return SumProfile(self, other)
+
+    def __repr__(self):
+        parameters = ", ".join(f"{name}={value!r}" for name, value in self._parameters().items())
+        return f"{type(self).__name__}({parameters})"
+
+
+class RectangularProfile(ThreadProfile):
     """
-    Rectangular profile: Uniform density across the entire width (max. 50%).
+    Rectangular profile: Uniform density across the entire width.
     """
-    if -1.0 <= x <= 1.0:
-        return _MAX_DENSITY
-    return 0.0
+    kind = "rectangular_profile"
+
+    def _shape(self, abs_x):
+        return np.ones_like(abs_x)
 
-def circular_profile(x: float) -> float:
+
+class CircularProfile(ThreadProfile):
     """
     Circular profile: Maximum density in the center,decreasing towards the edges.
     """
-    if -1.0 <= x <= 1.0:
-        return _MAX_DENSITY * math.sqrt(1.0 - x**2)
-    return 0.0
+    kind = "circular_profile"
+
+    def _shape(self, abs_x):
+        return np.sqrt(1.0 - abs_x**2)
+
 
-def trapezoidal_profile(x: float, core_width_normalized: float = 0.5) -> float:
+class TrapezoidalProfile(ThreadProfile):
     """
     Trapezoidal profile: Uniform density in the center, linearly decreasing towards the edges.
     """
-    if not (0.0 <= core_width_normalized <= 1.0):
-        raise ValueError("core_width_normalized must be in the range [0, 1].")
+    kind = "trapezoidal_profile"
 
-    abs_x = abs(x)
-    if abs_x <= core_width_normalized:
-        return _MAX_DENSITY # Full density in the core (max. 50%)
-    elif abs_x <= 1.0:
-        return _MAX_DENSITY * (1.0 - (abs_x - core_width_normalized) / (1.0 - core_width_normalized))
-    return 0.0
+    def __init__(self, core_width_normalized: float = 0.5, max_density: float = _MAX_DENSITY):
+        if not (0.0 <= core_width_normalized <= 1.0):
+            raise ValueError("core_width_normalized must be in the range [0, 1].")
+        super().__init__(max_density)
+        self.core_width_normalized = core_width_normalized
 
-def gaussian_profile(x: float, sigma_normalized: float = 0.3) -> float:
+    def _parameters(self):
+        return {"core_width_normalized": self.core_width_normalized, "max_density": self.max_density}
+
+    def __call__(self, x, core_width_normalized=None):
+        # keeps old function API trapezoidal_profile(x, core_width_normalized=...)
+        if core_width_normalized is not None and core_width_normalized != self.core_width_normalized:
+            return TrapezoidalProfile(core_width_normalized, self.max_density)(x)
+        return super().__call__(x)
+
+    def _shape(self, abs_x):
+        core = self.core_width_normalized
+        if core == 1.0:
+            return np.ones_like(abs_x)
+        return np.where(abs_x <= core, 1.0, 1.0 - (abs_x - core) / (1.0 - core))
+
+
+class GaussianProfile(ThreadProfile):
     """
     Gaussian profile: Soft, blurred edges.
     """
-    if not (x >= -1.0 and x <= 1.0):
-        return 0.0
+    kind = "gaussian_profile"
+
+    def __init__(self, sigma_normalized: float = 0.3, max_density: float = _MAX_DENSITY):
+        if sigma_normalized <= 0:
+            raise ValueError("sigma_normalized must be greater than 0.")
+        super().__init__(max_density)
+        self.sigma_normalized = sigma_normalized
+
+    def _parameters(self):
+        return {"sigma_normalized": self.sigma_normalized, "max_density": self.max_density}
+
+    def __call__(self, x, sigma_normalized=None):
+        # keeps old function API gaussian_profile(x, sigma_normalized=...)
+        if sigma_normalized is not None and sigma_normalized != self.sigma_normalized:
+            return GaussianProfile(sigma_normalized, self.max_density)(x)
+        return super().__call__(x)
+
+    def _shape(self, abs_x):
+        return np.exp(-(abs_x**2) / (2 * self.sigma_normalized**2))
+
+
+class ScaledProfile(ThreadProfile):
+    def __init__(self, base: ThreadProfile, factor: float):
+        super().__init__(min(1.0, base.max_density * factor))
+        self.base = base
+        self.factor = factor
+
+    def _parameters(self):
+        return {"base": self.base, "factor": self.factor}
+
+    @property
+    def name(self):
+        return f"{self.base.name}*{self.factor:g}"
+
+    def _shape(self, abs_x):
+        # base shape keeps its own max_density, result is rescaled to ours
+        if self.max_density == 0:
+            return np.zeros_like(abs_x)
+        return np.minimum(self.base(abs_x) * self.factor / self.max_density, 1.0)
+
+
+class SumProfile(ThreadProfile):
+    def __init__(self, first: ThreadProfile, second: ThreadProfile):
+        super().__init__(min(1.0, first.max_density + second.max_density))
+        self.first = first
+        self.second = second
+
+    def _parameters(self):
+        return {"first": self.first, "second": self.second}
+
+    @property
+    def name(self):
+        return f"{self.first.name}+{self.second.name}"
+
+    def _shape(self, abs_x):
+        if self.max_density == 0:
+            return np.zeros_like(abs_x)
+        return np.minimum((self.first(abs_x) + self.second(abs_x)) / self.max_density, 1.0)
+
+
+class FunctionProfile(ThreadProfile):
+    """
+    Wraps plain scalar function f(x) -> density, evaluated element by element (slow).
+    """
+    def __init__(self, function, max_density: float = _MAX_DENSITY):
+        super().__init__(max_density)
+        self.function = np.vectorize(function, otypes=[np.float64])
+        self.kind = getattr(function, "__name__", type(function).__name__)
+        self._function_name = f"{getattr(function, '__module__', None)}.{getattr(function, '__qualname__', self.kind)}"
+        # different lambdas or closures share a name, sampled densities tell them apart
+        samples = self(np.linspace(-1.0, 1.0, 257))
+        self._densities_hash = hashlib.blake2b(np.ascontiguousarray(samples).tobytes(), digest_size=8).hexdigest()
+
+    def _parameters(self):
+        return {"function": self._function_name, "densities": self._densities_hash, "max_density": self.max_density}
+
+    @property
+    def name(self):
+        return f"{self.kind}({self.max_density:g})"
+
+    def __call__(self, x):
+        density = np.clip(self.function(np.asarray(x, dtype=np.float64)), 0.0, self.max_density)
+        if density.ndim == 0:
+            return float(density)
+        return density
+
 
-    if sigma_normalized <= 0:
-        raise ValueError("sigma_normalized must be greater than 0.")
+def as_profile(profile) -> ThreadProfile:
+    """ThreadProfile for profile objects and plain functions"""
+    if isinstance(profile, ThreadProfile):
+        return profile
+    return FunctionProfile(profile)
 
-    density_unscaled = math.exp(-(x**2) / (2 * sigma_normalized**2))
-    
-    # Scale the result to _MAX_DENSITY
-    return _MAX_DENSITY * density_unscaled
+
+rectangular_profile = RectangularProfile()
+circular_profile = CircularProfile()
+trapezoidal_profile = TrapezoidalProfile()
+gaussian_profile = GaussianProfile()
 
 
 # --- Example usage and visualization (requires matplotlib) ---
 if __name__ == "__main__":
+    x_values = np.linspace(-1.0, 1.0, 201)
+    trapezoidal_06 = TrapezoidalProfile(core_width_normalized=0.6)
+    gaussian_03 = GaussianProfile(sigma_normalized=0.3)
     try:
         import matplotlib.pyplot as plt
         print("Matplotlib imported. Generating profile plots.")
 
-        x_values = [i / 100.0 for i in range(-100, 101)]
-
         plt.figure(figsize=(10, 7))
 
-        y_rect = [100*rectangular_profile(x) for x in x_values]
-        plt.plot(x_values, y_rect, label="Rectangular", linestyle='--')
-
-        y_circ = [100*circular_profile(x) for x in x_values]
-        plt.plot(x_values, y_circ, label="Circular")
-
-        y_trap = [100*trapezoidal_profile(x, core_width_normalized=0.6) for x in x_values]
-        plt.plot(x_values, y_trap, label="Trapezoidal (core 0.6)", linestyle=':')
-
-        y_gauss = [100*gaussian_profile(x, sigma_normalized=0.3) for x in x_values]
-        plt.plot(x_values, y_gauss, label="Gaussian (sigma 0.3)", linestyle='-.')
+        plt.plot(x_values, 100*rectangular_profile(x_values), label="Rectangular", linestyle='--')
+        plt.plot(x_values, 100*circular_profile(x_values), label="Circular")
+        plt.plot(x_values, 100*trapezoidal_06(x_values), label="Trapezoidal (core 0.6)", linestyle=':')
+        plt.plot(x_values, 100*gaussian_03(x_values), label="Gaussian (sigma 0.3)", linestyle='-.')
 
         plt.title(f"Normalized Thread Profiles (Max. Density: {_MAX_DENSITY*100:.0f}%)")
         plt.xlabel("Normalized position (x) [-1, 1]")
@@ -95,7 +253,6 @@ if __name__ == "__main__":
     print("\nExample usage (max. 0.5):")
     print(f"Rectangular (x=0.5): {rectangular_profile(0.5):.2f}")
     print(f"Circular (x=0.5): {circular_profile(0.5):.2f}")
-    print(f"Trapezoidal (x=0.8, core=0.6): {trapezoidal_profile(0.8, 0.6):.2f}")
-    print(f"Gaussian (x=0.0, sigma=0.3): {gaussian_profile(0.0, 0.3):.2f}")
-    print(f"Gaussian (x=0.9, sigma=0.3): {gaussian_profile(0.9, 0.3):.2f}")
-
+    print(f"Trapezoidal (x=0.8, core=0.6): {trapezoidal_06(0.8):.2f}")
+    print(f"Gaussian (x=0.0, sigma=0.3): {gaussian_03(0.0):.2f}")
+    print(f"Gaussian (x=0.9, sigma=0.3): {gaussian_03(0.9):.2f}")
@@ -0,0 +1,132 @@
+import struct
+import zlib
+import numpy as np
+
+"""
+Tiled canvas for poster size previews
+Canvas is split into fixed size tiles, a tile is allocated only when a thread crosses it.
+With path given tiles live in a np.memmap file instead of process memory.
+"""
+
+
+class TiledCanvas:
+    """
+    Float canvas of size height x width accumulating thread darkness.
+    """
+    def __init__(self, height: int, width: int, tile_size: int = 1024, path=None, dtype=np.float32):
+        """
+        Args:
+            height (int): canvas height in pixels
+            width (int): canvas width in pixels
+            tile_size (int): size of square tile
+            path (_type_): file backing the canvas, None keeps touched tiles in memory
+        """
+        if tile_size <= 0:
+            raise ValueError("tile_size must be greater than 0.")
+        self.height = height
+        self.width = width
+        self.tile_size = tile_size
+        self.dtype = np.dtype(dtype)
+        self.tiles_y = -(-height // tile_size)
+        self.tiles_x = -(-width // tile_size)
+        self._tiles = {}
+        self._memmap = None
+        if path is not None:
+            # file is sparse on most filesystems, untouched pages are never read
+            self._memmap = np.memmap(path, dtype=self.dtype, mode="w+", shape=(height, width))
+
+    def _tile_bounds(self, ty: int, tx: int) -> tuple:
+        top, left = ty * self.tile_size, tx * self.tile_size
+        return top, left, min(top + self.tile_size, self.height), min(left + self.tile_size, self.width)
+
+    def tile(self, ty: int, tx: int, create=False):
+        """tile array, None when the tile was never touched and create is False"""
+        if self._memmap is not None:
+            if not create and (ty, tx) not in self._tiles:
+                return None
+            top, left, bottom, right = self._tile_bounds(ty, tx)
+            self._tiles[(ty, tx)] = True
+            return self._memmap[top:bottom, left:right]
+        if (ty, tx) not in self._tiles:
+            if not create:
+                return None
+            top, left, bottom, right = self._tile_bounds(ty, tx)
+            self._tiles[(ty, tx)] = np.zeros((bottom - top, right - left), dtype=self.dtype)
+        return self._tiles[(ty, tx)]
+
+    @property
+    def touched_tiles(self) -> int:
+        return len(self._tiles)
+
+    def add(self, y_idx: np.ndarray, x_idx: np.ndarray, values: np.ndarray):
+        """adds values at pixels, indices may repeat"""
+        if y_idx.size == 0:
+            return
+        ty, tx = y_idx // self.tile_size, x_idx // self.tile_size
+        tile_ids = ty * self.tiles_x + tx
+        order = np.argsort(tile_ids, kind="stable")
+        tile_ids, y_idx, x_idx, values = tile_ids[order], y_idx[order], x_idx[order], values[order]
+        ids, starts = np.unique(tile_ids, return_index=True)
+        ends = np.append(starts[1:], tile_ids.size)
+        for tile_id, begin, end in zip(ids, starts, ends):
+            ty, tx = divmod(int(tile_id), self.tiles_x)
+            top, left, _, _ = self._tile_bounds(ty, tx)
+            np.add.at(self.tile(ty, tx, create=True), (y_idx[begin:end] - top, x_idx[begin:end] - left), values[begin:end])
+
+    def row_bands(self):
+        """yields (top, band) for every row of tiles, band covers full width"""
+        for ty in range(self.tiles_y):
+            top, _, bottom, _ = self._tile_bounds(ty, 0)
+            band = np.zeros((bottom - top, self.width), dtype=self.dtype)
+            for tx in range(self.tiles_x):
+                tile = self.tile(ty, tx)
+                if tile is not None:
+                    _, left, _, right = self._tile_bounds(ty, tx)
+                    band[:, left:right] = tile
+            yield top, band
+
+    def flush(self):
+        if self._memmap is not None:
+            self._memmap.flush()
+
+    def save_png(self, path, to_uint8):
+        """
+        Writes canvas as grayscale png one band of tiles at a time.
+        Args:
+            to_uint8 (_type_): function converting float band to uint8 pixels
+        """
+        write_png(path, self.width, self.height, (to_uint8(band) for _, band in self.row_bands()))
+
+
+def _png_chunk(file, chunk_type: bytes, data: bytes):
+    file.write(struct.pack(">I", len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+def write_png(path, width: int, height: int, bands):
+    """
+    Streaming 8 bit grayscale png writer.
+    Args:
+        bands (_type_): iterable of uint8 arrays of shape (rows, width), together height rows
+    """
+    compressor = zlib.compressobj(6)
+    rows_written = 0
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        for band in bands:
+            band = np.ascontiguousarray(band, dtype=np.uint8)
+            if band.ndim != 2 or band.shape[1] != width:
+                raise ValueError(f"Band must be of shape (rows, {width})")
+            # filter type 0 before every row
+            raw = np.hstack((np.zeros((band.shape[0], 1), dtype=np.uint8), band)).tobytes()
+            data = compressor.compress(raw)
+            if data:
+                _png_chunk(file, b"IDAT", data)
+            rows_written += band.shape[0]
+        _png_chunk(file, b"IDAT", compressor.flush())
+        _png_chunk(file, b"IEND", b"")
+    if rows_written != height:
+        raise ValueError(f"Expected {height} rows, got {rows_written}")